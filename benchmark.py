@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+
+from argparse import ArgumentParser
+from os.path import abspath, dirname, join
+from time import time
+
+from PIL import Image
+
+from fuzz import HeadlessDisplayDriver, LibraryWindow, Logger, LogLevel, PlayingWindow, PrefixIndex, Theme
+
+
+##
+# Benchmark Harness
+##
+
+class FrameStats(object):
+
+    def __init__(self):
+        self.drawTimes = []
+        self.displayTimes = []
+        self.transferTimes = []
+        self.bytesSent = []
+        self.windowCommands = []
+
+    def record(self, drawTime, displayTime, driver):
+        self.drawTimes.append(drawTime)
+        self.displayTimes.append(displayTime)
+        self.transferTimes.append(driver.transferTime)
+        self.bytesSent.append(driver.bytesSent)
+        self.windowCommands.append(driver.windowCommands)
+
+    def get_frames(self):
+        return len(self.drawTimes)
+
+    frames = property(get_frames)
+
+
+class Benchmark(object):
+
+    def __init__(self, pngDirectory=None):
+        self.logger = Logger(level=LogLevel.ERROR)
+        self.theme = Theme()
+        self.theme.fontPath = join(dirname(abspath(__file__)), self.theme.fontPath)
+        self._pngDirectory = pngDirectory
+
+    def run(self, scenarios):
+        results = []
+        for name, scenario in scenarios:
+            driver = HeadlessDisplayDriver(self.logger)
+            stats = FrameStats()
+            scenario(self, driver, stats)
+            if self._pngDirectory:
+                driver.save(join(self._pngDirectory, "%s.png" % name))
+            results.append((name, stats))
+        return results
+
+    def render(self, window, driver, stats):
+        driver.reset_counters()
+        t1 = time()
+        window.draw()
+        t2 = time()
+        window.display()
+        t3 = time()
+        stats.record(t2 - t1, t3 - t2, driver)
+
+    def playing_window(self, driver, stats):
+        window = PlayingWindow(self.theme, driver, self.logger)
+        window.ipLabel.text = "192.168.1.23"
+        window.ssidLabel.text = "Mini Fuzz"
+        window.volumeBar.volume = 40
+        self.render(window, driver, stats)
+        return window
+
+
+##
+# Scenarios
+##
+
+def track_change(benchmark, driver, stats):
+    window = benchmark.playing_window(driver, stats)
+    for i in range(10):
+        window.cover.image = Image.new("RGB", (500, 500), (20 * i, 100, 255 - 20 * i))
+        window.artistLabel.text = "Artist %d" % i
+        window.titleLabel.text = "Title of track number %d" % i
+        window.albumLabel.text = "Album %d (2020)" % i
+        window.progressBar.progress = 0
+        benchmark.render(window, driver, stats)
+
+
+def volume_sweep(benchmark, driver, stats):
+    window = benchmark.playing_window(driver, stats)
+    for volume in list(range(0, 101, 2)) + list(range(100, -1, -2)):
+        window.volumeBar.volume = volume
+        benchmark.render(window, driver, stats)
+
+
+def progress_ticks(benchmark, driver, stats):
+    window = benchmark.playing_window(driver, stats)
+    for progress in range(0, 101):
+        window.progressBar.progress = progress
+        benchmark.render(window, driver, stats)
+
+
+def library_push_pop(benchmark, driver, stats):
+    playingWindow = benchmark.playing_window(driver, stats)
+    libraryWindow = LibraryWindow(benchmark.theme, driver, benchmark.logger)
+    for _ in range(5):
+        # Mirrors what App does when pushing and popping LibraryWindowController
+        playingWindow.wasDisplayedOnce = False
+        benchmark.render(libraryWindow, driver, stats)
+        libraryWindow.wasDisplayedOnce = False
+        benchmark.render(playingWindow, driver, stats)
+
+
+def library_scroll(benchmark, driver, stats):
+    window = LibraryWindow(benchmark.theme, driver, benchmark.logger)
+    words = ["Black", "Velvet", "Electric", "Moon", "Quiet", "Riot", "Golden", "Static", "Paper", "Lions"]
+    artists = ("%s %s %d" % (words[i % 10], words[i // 10 % 10], i) for i in range(20000))
+    window.list.dataSource = PrefixIndex(artists).search()
+    benchmark.render(window, driver, stats)
+    for _ in range(40):
+        window.list.move_selection(1)
+        benchmark.render(window, driver, stats)
+    for _ in range(40):
+        window.list.move_selection(-1)
+        benchmark.render(window, driver, stats)
+
+
+SCENARIOS = [
+    ("track_change", track_change),
+    ("volume_sweep", volume_sweep),
+    ("progress_ticks", progress_ticks),
+    ("library_push_pop", library_push_pop),
+    ("library_scroll", library_scroll)
+]
+
+
+##
+# Main
+##
+
+def mean(values):
+    return sum(values) / len(values) if values else 0
+
+
+def report(results):
+    print("%-18s %6s %10s %10s %10s %10s %10s %8s" % (
+        "scenario", "frames", "draw ms", "draw max", "display ms", "spi ms", "bytes", "windows"))
+    for name, stats in results:
+        print("%-18s %6d %10.2f %10.2f %10.2f %10.2f %10d %8.1f" % (
+            name,
+            stats.frames,
+            mean(stats.drawTimes) * 1000,
+            max(stats.drawTimes) * 1000,
+            mean(stats.displayTimes) * 1000,
+            mean(stats.transferTimes) * 1000,
+            mean(stats.bytesSent),
+            mean(stats.windowCommands)))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Render benchmarks for the Mini Fuzz widget kit on a headless display")
+    parser.add_argument("scenarios", nargs="*", help="scenarios to run (default: all)")
+    parser.add_argument("--png", metavar="DIRECTORY", help="save the final frame of each scenario as PNG")
+    args = parser.parse_args()
+
+    scenarios = [(name, scenario) for name, scenario in SCENARIOS if not args.scenarios or name in args.scenarios]
+    report(Benchmark(args.png).run(scenarios))
@@ -1,38 +1,300 @@
 #!/usr/bin/python3
 
+import asyncio
+
+from argparse import ArgumentParser
+from bisect import bisect_right
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from enum import Enum
+from hashlib import sha1
+from heapq import heappop, heappush
 from math import ceil, floor
-from os import listdir
-from os.path import dirname, isfile, splitext
+from os import _exit, listdir, makedirs, remove, replace, sysconf
+from os.path import basename, dirname, exists, expanduser, getmtime, isfile, join, splitext
 from queue import Empty, Queue
-from select import select
-from socket import socket, AF_INET, SOCK_DGRAM
+from signal import signal, SIGTERM, SIGUSR1, SIGUSR2
+from socket import socket, AF_INET, AF_UNIX, SOCK_DGRAM, SOCK_STREAM
+from sqlite3 import connect as sqlite_connect
 from subprocess import Popen, PIPE
-from threading import currentThread, Thread, Timer
-from time import sleep, time
+from sys import _current_frames, stdout
+from threading import Condition, currentThread, enumerate as enumerate_threads, Event, Lock, Thread
+from time import monotonic, sleep, time
+
+from PIL import Image, ImageChops, ImageDraw, ImageFont
 
-from Adafruit_ADS1x15 import ADS1115
-from adafruit_rgb_display import color565
-from adafruit_rgb_display.ili9341 import ILI9341
-from board import SCK, MOSI, MISO, D8, D24, D25
-from busio import SPI
-from digitalio import DigitalInOut
-from mpd import MPDClient
-from PIL import Image, ImageDraw, ImageFont
-from RPi import GPIO
+# Hardware specific modules are only imported where the hardware is actually used so that the rest of the
+# code (e.g. the widget kit) can be run on machines other than the Pi. The same goes for the MPD client which
+# isn't needed for the first frame and thus imported on the threads that talk to MPD.
 
 
 ##
 # Logger
 ##
 
+class LogLevel(Enum):
+
+    DEBUG = 1
+    INFO = 2
+    ERROR = 3
+
+
 class Logger(object):
 
-    def log_info(self, message):
-        print("[INFO | %s] %s" % (currentThread().getName(), message))
+    # Messages below the level are dropped before anything is formatted. The others are kept in a ring buffer
+    # together with their arguments and only formatted when written, which happens on a background thread for
+    # messages from the output level on. Messages waiting to be written are bounded by the capacity as well.
+    # When the stream can't keep up, the oldest ones are dropped and only their number is written. The whole
+    # buffer can be written with dump(), e.g. to see the recent debug messages after something went wrong.
+
+    def __init__(self, level=LogLevel.INFO, outputLevel=LogLevel.INFO, capacity=2000, stream=stdout):
+        self.level = level
+        self.outputLevel = outputLevel
+        self._stream = stream
+        self._records = deque(maxlen=capacity)
+        self._pending = deque(maxlen=capacity)
+        self._dropped = 0
+        self._wake = Event()
+        self._writeLock = Lock()
+        Thread(target=self._write, name="Logger", daemon=True).start()
+
+    def log_debug(self, message, *args):
+        if self.level.value <= LogLevel.DEBUG.value:
+            self._log(LogLevel.DEBUG, message, args)
+
+    def log_info(self, message, *args):
+        if self.level.value <= LogLevel.INFO.value:
+            self._log(LogLevel.INFO, message, args)
+
+    def log_error(self, message, *args):
+        self._log(LogLevel.ERROR, message, args)
+
+    def dump(self):
+        self._pending.append(None)
+        self._wake.set()
+
+    def flush(self):
+        # Writes the pending messages on the calling thread, e.g. right before exiting
+        with self._writeLock:
+            self._drain()
+
+    def _log(self, level, message, args):
+        record = (level, currentThread().getName(), message, args)
+        self._records.append(record)
+        if level.value >= self.outputLevel.value:
+            if len(self._pending) == self._pending.maxlen:
+                self._dropped += 1
+            self._pending.append(record)
+            self._wake.set()
+
+    def _write(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            with self._writeLock:
+                self._drain()
+
+    def _drain(self):
+        while self._pending:
+            if self._dropped:
+                # Messages might be dropped while writing so the count is taken before
+                dropped = self._dropped
+                self._dropped -= dropped
+                self._stream.write("[ERROR | Logger] Dropped %d messages\n" % dropped)
+            record = self._pending.popleft()
+            if record:
+                self._stream.write(self._format(record))
+            else:
+                self._stream.write("[DUMP | Logger] %d buffered messages\n" % len(self._records))
+                for buffered in list(self._records):
+                    self._stream.write(self._format(buffered))
+        self._stream.flush()
 
-    def log_error(self, message):
-        print("[WARNING | %s] %s" % (currentThread().getName(), message))
+    def _format(self, record):
+        level, threadName, message, args = record
+        if args:
+            try:
+                message = message % args
+            except (TypeError, ValueError) as e:
+                message = "%s %s (%s)" % (message, args, e)
+        return "[%s | %s] %s\n" % (level.name, threadName, message)
+
+
+##
+# Metrics
+##
+
+def get_process_age():
+    # Seconds since the process was started including the time it took to import the modules or None if the
+    # system doesn't tell
+    try:
+        with open("/proc/self/stat") as file:
+            startTicks = int(file.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as file:
+            uptime = float(file.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    return uptime - startTicks / sysconf("SC_CLK_TCK")
+
+
+class Distribution(object):
+
+    # Keeps the most recent samples of a measurement. Percentiles are only computed when a report is asked
+    # for so that recording a sample is just an append.
+
+    def __init__(self, maxSamples=1024):
+        self._samples = deque(maxlen=maxSamples)
+        self._lock = Lock()
+        self.count = 0
+
+    def record(self, value):
+        with self._lock:
+            self._samples.append(value)
+            self.count += 1
+
+    def get_percentiles(self, *percentiles):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return [0 for _ in percentiles]
+        return [samples[min(len(samples) - 1, floor(len(samples) * percentile / 100))] for percentile in percentiles]
+
+
+class Metrics(object):
+
+    # Distributions of timings (in ms) and sizes from across the player, e.g. the phases of a frame, the
+    # queues and MPD round trips. Components look up Metrics.current when they have something to record so
+    # that nothing is measured unless metrics were installed. Reports are served as plain text on a UNIX
+    # socket, e.g. with "socat - UNIX-CONNECT:/tmp/minifuzz-metrics.sock".
+
+    current = None
+
+    def __init__(self, logger, path="/tmp/minifuzz-metrics.sock"):
+        self._logger = logger
+        self._path = path
+        self._distributions = {}
+        self._distributionsLock = Lock()
+        self._inputTime = None
+
+    def install(self):
+        Metrics.current = self
+        Thread(target=self._serve, name="Metrics", daemon=True).start()
+
+    def record(self, name, value):
+        distribution = self._distributions.get(name)
+        if not distribution:
+            with self._distributionsLock:
+                distribution = self._distributions.setdefault(name, Distribution())
+        distribution.record(value)
+
+    def record_input(self):
+        # Input latency runs from the first input after a frame until the next frame is on the display
+        if self._inputTime is None:
+            self._inputTime = monotonic()
+
+    def record_frame(self, duration):
+        self.record("frame_ms", duration * 1000)
+        inputTime = self._inputTime
+        if inputTime is not None:
+            self._inputTime = None
+            self.record("input_ms", (monotonic() - inputTime) * 1000)
+
+    def report(self):
+        with self._distributionsLock:
+            distributions = sorted(self._distributions.items())
+        lines = ["%-32s %8s %10s %10s %10s" % ("metric", "count", "p50", "p99", "max")]
+        for name, distribution in distributions:
+            p50, p99, maximum = distribution.get_percentiles(50, 99, 100)
+            lines.append("%-32s %8d %10.2f %10.2f %10.2f" % (name, distribution.count, p50, p99, maximum))
+        return "\n".join(lines) + "\n"
+
+    def _serve(self):
+        if exists(self._path):
+            remove(self._path)
+        server = socket(AF_UNIX, SOCK_STREAM)
+        server.bind(self._path)
+        server.listen(1)
+        self._logger.log_info("Serving metrics on %s", self._path)
+        while True:
+            connection, _ = server.accept()
+            try:
+                connection.sendall(self.report().encode())
+            except OSError as e:
+                self._logger.log_error("Could not send metrics: %s", e)
+            finally:
+                connection.close()
+
+
+##
+# Profiler
+##
+
+class SamplingProfiler(object):
+
+    # Takes the stacks of the threads doing the player's work (the serial queues, rendering, timers and the
+    # event loop runtime) at a fixed rate while running. When stopped, the number of times each stack was
+    # seen is written in the collapsed format that flame graph tools read, one "frame;frame;frame count" line
+    # per stack. Sampling only pauses the other threads for as long as it takes to copy their stacks.
+
+    _threadNames = ("App", "Runtime", "Scheduler")
+    # The runtime's executors name their workers "Runtime <name>"
+    _threadPrefixes = ("SerialQueue ", "Runtime ")
+
+    def __init__(self, logger, interval=0.02, path="/tmp/minifuzz-profile.txt"):
+        self._logger = logger
+        self._interval = interval
+        self._path = path
+        self._stop = None
+
+    def toggle(self):
+        if self._stop:
+            self.stop()
+        else:
+            self.start()
+
+    def start(self):
+        if self._stop:
+            return
+        self._logger.log_info("Starting profiler")
+        self._stop = Event()
+        Thread(target=self._sample, args=(self._stop,), name="Profiler", daemon=True).start()
+
+    def stop(self):
+        if self._stop:
+            self._stop.set()
+            self._stop = None
+
+    def _sample(self, stop):
+        stacks = {}
+        samples = 0
+        while not stop.wait(self._interval):
+            names = {thread.ident: thread.name for thread in enumerate_threads() if self._is_profiled(thread.name)}
+            for ident, frame in _current_frames().items():
+                if ident in names:
+                    stack = self._collapse(names[ident], frame)
+                    stacks[stack] = stacks.get(stack, 0) + 1
+            samples += 1
+
+        try:
+            with open(self._path, "w") as file:
+                for stack, count in sorted(stacks.items()):
+                    file.write("%s %d\n" % (stack, count))
+            self._logger.log_info("Wrote %d profiler samples to %s", samples, self._path)
+        except OSError as e:
+            self._logger.log_error("Could not write profile to %s: %s", self._path, e)
+
+    def _is_profiled(self, name):
+        return name in self._threadNames or name.startswith(self._threadPrefixes)
+
+    def _collapse(self, threadName, frame):
+        names = []
+        while frame:
+            code = frame.f_code
+            names.append("%s:%s" % (basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        names.append(threadName.replace(";", ","))
+        return ";".join(reversed(names))
 
 
 ##
@@ -41,41 +303,457 @@ class Logger(object):
 
 class Theme(object):
 
+    # Loading a font is expensive so the font objects are shared between all themes and widgets
+    _fonts = {}
+    _fontsLock = Lock()
+
     def __init__(self):
         self.fontPath = "Inconsolata-Regular.ttf"
         self.mainColor = 0x00ff00
         self.volumeColors = [0x00ff00, 0x00ffff, 0x0000ff]
+        self.selectionColor = 0xffffff
 
     def get_font(self, size):
-        return ImageFont.truetype(self.fontPath, size)
+        key = (self.fontPath, size)
+        with Theme._fontsLock:
+            if key not in Theme._fonts:
+                Theme._fonts[key] = ImageFont.truetype(self.fontPath, size)
+            return Theme._fonts[key]
+
+
+##
+# Text Cache
+##
+
+class TextCache(object):
+
+    # LRU cache of rendered text bitmaps so that redrawing unchanged text is a single paste. The cache is
+    # bounded by the memory used by the bitmaps rather than by the number of entries.
+
+    def __init__(self, maxBytes=1024 * 1024):
+        self._maxBytes = maxBytes
+        self._bytes = 0
+        self._bitmaps = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, text, font, color, alignment, width, height):
+        key = (text, font.path, font.size, color, alignment, width, height)
+
+        with self._lock:
+            bitmap = self._bitmaps.get(key)
+            if bitmap:
+                self._bitmaps.move_to_end(key)
+                return bitmap
+
+        bitmap = self._render(text, font, color, alignment, width, height)
+        size = width * height * len(bitmap.getbands())
+
+        with self._lock:
+            if key not in self._bitmaps:
+                self._bitmaps[key] = bitmap
+                self._bytes += size
+            while self._bytes > self._maxBytes and len(self._bitmaps) > 1:
+                _, evicted = self._bitmaps.popitem(last=False)
+                self._bytes -= evicted.width * evicted.height * len(evicted.getbands())
+
+        return bitmap
+
+    def _render(self, text, font, color, alignment, width, height):
+        bitmap = Image.new("RGB", (width, height), "black")
+        context = ImageDraw.Draw(bitmap)
+
+        if alignment == TextAlignment.LEFT:
+            x = 0
+        elif alignment == TextAlignment.RIGHT:
+            size = context.textsize(text, font)
+            x = width - size[0]
+        elif alignment == TextAlignment.CENTER:
+            size = context.textsize(text, font)
+            x = round((width - size[0]) / 2.0)
+
+        context.text((x, 0), text, font=font, fill=color)
+        return bitmap
 
 
 ##
 # Display Driver
 ##
 
+class DisplayCostModel(object):
+
+    # Linear model of the time it takes to send an area to the display: a fixed overhead per transfer (setting
+    # the address window, starting the SPI transaction, PIL conversions) plus a cost per transmitted pixel. The
+    # defaults stem from measurements on the Pi Zero where even small images take around 0.05s while the whole
+    # display takes around 0.25s. Once enough transfers have been observed, both values are re-estimated from
+    # the actual timings with a least squares fit.
+
+    def __init__(self, transferOverhead=0.05, pixelCost=0.2 / (240 * 320), minSamples=8, maxSamples=64):
+        self.transferOverhead = transferOverhead
+        self.pixelCost = pixelCost
+        self._minSamples = minSamples
+        self._samples = deque(maxlen=maxSamples)
+
+    def cost(self, frames):
+        return sum(self.transferOverhead + frame.area * self.pixelCost for frame in frames)
+
+    def record(self, pixels, duration):
+        self._samples.append((pixels, duration))
+        self._fit()
+
+    def _fit(self):
+        n = len(self._samples)
+        if n < self._minSamples:
+            return
+
+        sx = sum(pixels for pixels, _ in self._samples)
+        sy = sum(duration for _, duration in self._samples)
+        sxx = sum(pixels * pixels for pixels, _ in self._samples)
+        sxy = sum(pixels * duration for pixels, duration in self._samples)
+
+        # All samples having (nearly) the same size doesn't allow telling overhead and pixel cost apart
+        denominator = n * sxx - sx * sx
+        if denominator <= 0:
+            return
+
+        pixelCost = (n * sxy - sx * sy) / denominator
+        transferOverhead = (sy - pixelCost * sx) / n
+
+        # Noisy measurements can produce nonsensical estimates in which case the previous ones are kept
+        if pixelCost <= 0 or transferOverhead < 0:
+            return
+
+        self.pixelCost = pixelCost
+        self.transferOverhead = transferOverhead
+
+
 class DisplayDriver(object):
 
-    def __init__(self, logger):
+    # The display RAM can be scrolled vertically in hardware: the rows of a full width scroll area are shown
+    # shifted by an offset and wrap around at its end. Frames are given in screen coordinates and mapped to
+    # the rows of the display RAM that are currently shown there, split where the scroll area wraps around.
+
+    def __init__(self, logger, width, height):
         self._logger = logger
-        self._logger.log_info("Initializing display")
-        spi = SPI(clock=SCK, MOSI=MOSI, MISO=MISO)
-        self._driver = ILI9341(spi, cs=DigitalInOut(D8), dc=DigitalInOut(D24), rst=DigitalInOut(D25))
-        self._driver.fill(0)
+        self._width = width
+        self._height = height
+        self._scrollTop = 0
+        self._scrollHeight = height
+        self._scrollOffset = 0
+        self.costModel = DisplayCostModel()
 
     def get_width(self):
-        return self._driver.width
+        return self._width
 
     width = property(get_width)
 
     def get_height(self):
-        return self._driver.height
+        return self._height
 
     height = property(get_height)
 
-    def display(self, image, x=0, y=0):
-        self._logger.log_info("Displaying image at (%d,%d)" % (x, y))
-        self._driver.image(image, x=x, y=y)
+    def display(self, data, frame):
+        self._logger.log_debug("Displaying frame %s", frame)
+        rowBytes = frame.width * 2
+        for start, end, memoryFrame in self._map_rows(frame):
+            duration = self._display(data[start * rowBytes:end * rowBytes], memoryFrame)
+            self.costModel.record(memoryFrame.area, duration)
+
+    def scroll(self, frame, distance):
+        # Moves the rows of the full width frame up by distance (or down if negative) without sending them
+        # again. Returns False if that isn't possible in which case nothing changes on the display.
+        if frame.width != self._width or abs(distance) >= frame.height:
+            return False
+        if frame.y0 != self._scrollTop or frame.height != self._scrollHeight:
+            # Redefining the scroll area while it is scrolled would mix up what is shown
+            if self._scrollOffset:
+                return False
+            self._scrollTop = frame.y0
+            self._scrollHeight = frame.height
+            self._define_scroll_area(self._scrollTop, self._scrollHeight)
+        self._logger.log_debug("Scrolling frame %s by %d rows", frame, distance)
+        self._scrollOffset = (self._scrollOffset + distance) % self._scrollHeight
+        self._scroll_to(self._scrollTop + self._scrollOffset)
+        return True
+
+    def reset_scroll(self):
+        if self._scrollOffset:
+            self._scrollOffset = 0
+            self._scroll_to(self._scrollTop)
+
+    def _get_memory_row(self, y):
+        if y < self._scrollTop or y >= self._scrollTop + self._scrollHeight:
+            return y
+        return self._scrollTop + (y - self._scrollTop + self._scrollOffset) % self._scrollHeight
+
+    def _map_rows(self, frame):
+        # Yields the rows of the frame that are contiguous in the display RAM along with the RAM frame
+        y = frame.y0
+        while y <= frame.y1:
+            memoryRow = self._get_memory_row(y)
+            if y < self._scrollTop:
+                end = min(frame.y1, self._scrollTop - 1)
+            elif y < self._scrollTop + self._scrollHeight:
+                # The scroll area either wraps around in the display RAM or ends
+                end = min(frame.y1, y + self._scrollTop + self._scrollHeight - 1 - memoryRow,
+                    self._scrollTop + self._scrollHeight - 1)
+            else:
+                end = frame.y1
+            yield y - frame.y0, end - frame.y0 + 1, Frame(frame.x0, memoryRow, frame.x1, memoryRow + end - y)
+            y = end + 1
+
+    def _display(self, data, frame):
+        # Sends the RGB565 pixel data of the frame to the display RAM and returns the time the transfer took
+        raise NotImplementedError()
+
+    def _define_scroll_area(self, top, height):
+        raise NotImplementedError()
+
+    def _scroll_to(self, row):
+        # Makes the display RAM row the first one shown in the scroll area
+        raise NotImplementedError()
+
+
+class ILI9341DisplayDriver(DisplayDriver):
+
+    def __init__(self, logger):
+        from adafruit_rgb_display.ili9341 import ILI9341
+        from board import SCK, MOSI, MISO, D8, D24, D25
+        from busio import SPI
+        from digitalio import DigitalInOut
+
+        logger.log_info("Initializing display")
+        spi = SPI(clock=SCK, MOSI=MOSI, MISO=MISO)
+        # Clearing the display is left to the first frame which covers all of it anyway
+        self._driver = ILI9341(spi, cs=DigitalInOut(D8), dc=DigitalInOut(D24), rst=DigitalInOut(D25))
+        super().__init__(logger, self._driver.width, self._driver.height)
+
+    def _display(self, data, frame):
+        # The data is already in the display's native format so it can be written to the display RAM directly
+        # instead of going through ILI9341.image which converts every pixel in Python
+        t1 = time()
+        self._driver._block(frame.x0, frame.y0, frame.x1, frame.y1, data)
+        return time() - t1
+
+    def _define_scroll_area(self, top, height):
+        # VSCRDEF takes the heights of the top fixed area, the scroll area and the bottom fixed area
+        bottom = self.height - top - height
+        self._driver.write(0x33, top.to_bytes(2, "big") + height.to_bytes(2, "big") + bottom.to_bytes(2, "big"))
+
+    def _scroll_to(self, row):
+        # VSCRSAD
+        self._driver.write(0x37, row.to_bytes(2, "big"))
+
+
+class HeadlessDisplayDriver(DisplayDriver):
+
+    # Keeps the display contents in memory and models the cost of sending them to an ILI9341 over SPI. Every
+    # transfer sets the address window (CASET and PASET with 4 parameter bytes each), issues RAMWR and then
+    # streams 2 bytes per pixel. Scrolling costs a single command with a few parameter bytes. The default
+    # timings approximate the measurements on the Pi Zero where the Python side of a transfer adds
+    # considerably to the wire time.
+
+    def __init__(self, logger, width=240, height=320, baudrate=16000000, commandOverhead=0.05, pixelOverhead=1.6e-6):
+        logger.log_info("Initializing headless display")
+        super().__init__(logger, width, height)
+        self.baudrate = baudrate
+        self.commandOverhead = commandOverhead
+        self.pixelOverhead = pixelOverhead
+        self._data = bytearray(width * height * 2)
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.bytesSent = 0
+        self.windowCommands = 0
+        self.scrollCommands = 0
+        self.transferTime = 0
+
+    def _display(self, data, frame):
+        rowBytes = frame.width * 2
+        for row in range(frame.height):
+            offset = ((frame.y0 + row) * self.width + frame.x0) * 2
+            self._data[offset:offset + rowBytes] = data[row * rowBytes:(row + 1) * rowBytes]
+
+        pixels = frame.area
+        sent = 3 + 2 * 4 + 2 * pixels
+        duration = self.commandOverhead + pixels * self.pixelOverhead + sent * 8 / self.baudrate
+
+        self.bytesSent += sent
+        self.windowCommands += 1
+        self.transferTime += duration
+
+        return duration
+
+    def _define_scroll_area(self, top, height):
+        self._send_command(6)
+
+    def _scroll_to(self, row):
+        self._send_command(2)
+
+    def _send_command(self, parameterBytes):
+        sent = 1 + parameterBytes
+        self.bytesSent += sent
+        self.scrollCommands += 1
+        self.transferTime += sent * 8 / self.baudrate
+
+    def get_image(self):
+        # What the panel shows, i.e. the display RAM with the scroll area applied
+        rowBytes = self.width * 2
+        data = b"".join(
+            self._data[self._get_memory_row(y) * rowBytes:][:rowBytes] for y in range(self.height))
+        return Framebuffer.decode(data, self.width, self.height)
+
+    image = property(get_image)
+
+    def save(self, path):
+        self.image.save(path, "PNG")
+
+
+##
+# Framebuffer
+##
+
+class Framebuffer(object):
+
+    # The display contents in the ILI9341's native format (RGB565, big endian). Regions are converted from
+    # PIL images with band-wise lookup tables which run in C rather than converting pixel by pixel in Python.
+    # The 5 bits of red and the upper 3 bits of green make up the high byte, the lower 3 bits of green and
+    # the 5 bits of blue the low byte. As the bits of the two bands in each byte don't overlap, adding them
+    # up yields the packed byte.
+
+    _HIGH_RED = [value & 0xf8 for value in range(256)]
+    _HIGH_GREEN = [value >> 5 for value in range(256)]
+    _LOW_GREEN = [(value << 3) & 0xe0 for value in range(256)]
+    _LOW_BLUE = [value >> 3 for value in range(256)]
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.data = bytearray(width * height * 2)
+        self._view = memoryview(self.data)
+
+    def update(self, layer, frame):
+        # Converts the frame's region of the layer and returns it packed for sending to the display
+        data = Framebuffer.encode(layer.crop(frame.crop_box))
+        rowBytes = frame.width * 2
+        if frame.width == self.width:
+            offset = frame.y0 * rowBytes
+            self.data[offset:offset + len(data)] = data
+        else:
+            for row in range(frame.height):
+                offset = ((frame.y0 + row) * self.width + frame.x0) * 2
+                self.data[offset:offset + rowBytes] = data[row * rowBytes:(row + 1) * rowBytes]
+        return memoryview(data)
+
+    def get_region(self, frame):
+        # Full width regions are contiguous in the buffer and can be handed out without copying
+        rowBytes = frame.width * 2
+        if frame.width == self.width:
+            return self._view[frame.y0 * rowBytes:(frame.y1 + 1) * rowBytes]
+        return b"".join(
+            self._view[((frame.y0 + row) * self.width + frame.x0) * 2:][:rowBytes] for row in range(frame.height))
+
+    def copy(self, other, frame):
+        rowBytes = frame.width * 2
+        for row in range(frame.height):
+            offset = ((frame.y0 + row) * self.width + frame.x0) * 2
+            self.data[offset:offset + rowBytes] = other.data[offset:offset + rowBytes]
+
+    def scroll(self, frame, distance):
+        # Mirrors scrolling the display: the rows of the full width frame move up by distance and wrap around
+        rowBytes = self.width * 2
+        start = frame.y0 * rowBytes
+        end = (frame.y1 + 1) * rowBytes
+        split = start + distance % frame.height * rowBytes
+        self.data[start:end] = self.data[split:end] + self.data[start:split]
+
+    def diff(self, other, frame):
+        # Returns the bounding frames of the pixels within frame that differ from the other buffer, one per run
+        # of consecutive changed rows. The changed span of each row is found by XORing the rows as integers
+        # which avoids comparing them pixel by pixel in Python.
+        changes = []
+        band = None
+        rowBytes = frame.width * 2
+        for y in range(frame.y0, frame.y1 + 1):
+            offset = (y * self.width + frame.x0) * 2
+            new = self.data[offset:offset + rowBytes]
+            old = other.data[offset:offset + rowBytes]
+            if new == old:
+                if band:
+                    changes.append(Frame(*band))
+                    band = None
+                continue
+            xor = int.from_bytes(new, "big") ^ int.from_bytes(old, "big")
+            first = frame.x0 + (rowBytes - 1 - (xor.bit_length() - 1) // 8) // 2
+            last = frame.x0 + (rowBytes - 1 - ((xor & -xor).bit_length() - 1) // 8) // 2
+            if band:
+                band = [min(band[0], first), band[1], max(band[2], last), y]
+            else:
+                band = [first, y, last, y]
+        if band:
+            changes.append(Frame(*band))
+        return changes
+
+    @staticmethod
+    def encode(image):
+        red, green, blue = image.convert("RGB").split()
+        high = ImageChops.add(red.point(Framebuffer._HIGH_RED), green.point(Framebuffer._HIGH_GREEN))
+        low = ImageChops.add(green.point(Framebuffer._LOW_GREEN), blue.point(Framebuffer._LOW_BLUE))
+        return Image.merge("LA", (high, low)).tobytes()
+
+    @staticmethod
+    def decode(data, width, height):
+        high, low = Image.frombytes("LA", (width, height), bytes(data)).split()
+        red = high.point(lambda value: value & 0xf8)
+        green = ImageChops.add(high.point(lambda value: (value & 0x07) << 5), low.point(lambda value: (value & 0xe0) >> 3))
+        blue = low.point(lambda value: (value & 0x1f) << 3)
+        return Image.merge("RGB", (red, green, blue))
+
+
+class FrameSnapshot(object):
+
+    # The last frame on the display saved in the display's native format. Sending it right after the display
+    # was initialized brings back the screen from before the restart while the app is still starting. Frames
+    # are only written if they changed since the last save to keep the writes to the SD card down.
+
+    def __init__(self, logger, path="~/.cache/minifuzz/last-frame.rgb565", interval=300):
+        self._logger = logger
+        self._path = expanduser(path)
+        self.interval = interval
+        self.data = None
+        self._queue = SerialQueue("Frame Snapshot", logger, blocking=True)
+
+    def load(self, width, height):
+        try:
+            with open(self._path, "rb") as file:
+                data = file.read()
+        except OSError:
+            self._logger.log_info("No frame snapshot at %s", self._path)
+            return None
+        if len(data) != width * height * 2:
+            self._logger.log_error("Ignoring frame snapshot of unexpected size %d", len(data))
+            return None
+        self.data = data
+        return data
+
+    def save(self, data):
+        self._queue.run_sync(lambda: self._save(data))
+
+    def save_async(self, data):
+        self._queue.run_async(lambda: self._save(data))
+
+    def _save(self, data):
+        if data == self.data:
+            return
+        try:
+            makedirs(dirname(self._path), exist_ok=True)
+            temporaryPath = self._path + ".tmp"
+            with open(temporaryPath, "wb") as file:
+                file.write(data)
+            replace(temporaryPath, self._path)
+            self.data = data
+            self._logger.log_info("Saved frame snapshot to %s", self._path)
+        except OSError as e:
+            self._logger.log_error("Could not save frame snapshot to %s: %s", self._path, e)
 
 
 ##
@@ -84,23 +762,317 @@ class DisplayDriver(object):
 
 class SerialQueue(object):
 
-    def __init__(self, name):
-        self._queue = Queue()
-        Thread(target=self._run, name="SerialQueue %s" % name).start()
+    # Tasks are run one after the other in the order they were added. A task may return a coroutine which is
+    # run to completion before the next task starts. Failing tasks are logged and don't stop the queue. By
+    # default every queue runs on its own thread. With an installed EventLoopRuntime, queues become tasks on
+    # its event loop instead and the tasks of blocking queues (image decoding, network I/O) are run on the
+    # runtime's executor. Dedicated blocking queues get a worker of their own instead so that their tasks don't
+    # wait for other blocking work. Tasks added with a key replace a pending task with the same key so that
+    # only the latest one runs (at the position of the first).
+
+    def __init__(self, name, logger, blocking=False, dedicated=False):
+        self.name = name
+        self._logger = logger
+        self._blocking = blocking
+        self._keyedTasks = {}
+        self._keyedTasksLock = Lock()
+        self._runtime = EventLoopRuntime.current
+        if self._runtime:
+            self._executor = None
+            if blocking and dedicated:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Runtime %s" % name)
+            self._pending = asyncio.Queue()
+            self._runtime.spawn(self._consume())
+        else:
+            self._queue = Queue()
+            self._loop = None
+            Thread(target=self._run, name="SerialQueue %s" % name).start()
 
     def _run(self):
         while True:
-            self._queue.get()()
-            self._queue.task_done()
+            task, enqueued = self._queue.get()
+            self._record_wait(monotonic() - enqueued)
+            try:
+                result = task()
+                if asyncio.iscoroutine(result):
+                    if not self._loop:
+                        self._loop = asyncio.new_event_loop()
+                    self._loop.run_until_complete(result)
+            except Exception as e:
+                # A failing task must not take the queue down with it
+                self._logger.log_error("Task %s on queue %s failed: %s", task, self.name, e)
+            finally:
+                self._queue.task_done()
+
+    async def _consume(self):
+        while True:
+            task, enqueued, done = await self._pending.get()
+            started = monotonic()
+            self._record_wait(started - enqueued)
+            try:
+                if self._blocking:
+                    result = await EventLoopRuntime.run_blocking(task, self._executor)
+                else:
+                    result = task()
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                self._logger.log_error("Task %s on queue %s failed: %s", task, self.name, e)
+            finally:
+                self._runtime.record_latency(self.name, started - enqueued, monotonic() - started)
+                if done:
+                    done.set()
 
     def run_sync(self, task):
+        if self._runtime:
+            if self._runtime.is_running_in_loop():
+                # Waiting for the task would block the event loop that is supposed to run it
+                self.run_async(task)
+                return
+            done = Event()
+            self._runtime.call_soon(lambda: self._pending.put_nowait((task, monotonic(), done)))
+            done.wait()
+            return
+
         # This isn't quite exact as there could be other tasks added to the queue before the
         # call to join but (hopefully) it'll be enough for our needs here
         self.run_async(task)
         self._queue.join()
 
-    def run_async(self, task):
-        self._queue.put(task)
+    def run_async(self, task, key=None):
+        if key is not None:
+            with self._keyedTasksLock:
+                isPending = key in self._keyedTasks
+                self._keyedTasks[key] = task
+            if isPending:
+                return
+            task = lambda: self._run_keyed(key)
+
+        metrics = Metrics.current
+        if metrics:
+            metrics.record("queue.%s.depth" % self.name, (self._pending if self._runtime else self._queue).qsize())
+
+        if self._runtime:
+            enqueued = monotonic()
+            self._runtime.call_soon(lambda: self._pending.put_nowait((task, enqueued, None)))
+        else:
+            self._queue.put((task, monotonic()))
+
+    def _record_wait(self, wait):
+        metrics = Metrics.current
+        if metrics:
+            metrics.record("queue.%s.wait_ms" % self.name, wait * 1000)
+
+    def _run_keyed(self, key):
+        with self._keyedTasksLock:
+            task = self._keyedTasks.pop(key)
+        return task()
+
+
+##
+# Event Loop Runtime
+##
+
+class TaskLatency(object):
+
+    def __init__(self):
+        self.count = 0
+        self.totalWait = 0
+        self.maxWait = 0
+        self.totalRun = 0
+        self.maxRun = 0
+
+    def record(self, wait, run):
+        self.count += 1
+        self.totalWait += wait
+        self.maxWait = max(self.maxWait, wait)
+        self.totalRun += run
+        self.maxRun = max(self.maxRun, run)
+
+    def __str__(self):
+        return "%d tasks, wait avg %.1fms max %.1fms, run avg %.1fms max %.1fms" % (
+            self.count,
+            self.totalWait / self.count * 1000,
+            self.maxWait * 1000,
+            self.totalRun / self.count * 1000,
+            self.maxRun * 1000)
+
+
+class EventLoopRuntime(object):
+
+    # Optional single event loop runtime. Instead of one thread per SerialQueue plus threads for rendering and
+    # timers, everything runs as tasks on one asyncio event loop. Only blocking work (image decoding, MPD
+    # commands) is handed to a small executor while SPI transfers and playback control have workers of their
+    # own. The runtime must be installed before any queues are created and logs the latency of the tasks of
+    # every queue periodically.
+
+    current = None
+
+    def __init__(self, logger, workers=2, statsInterval=60):
+        self._logger = logger
+        self._statsInterval = statsInterval
+        self._latencies = {}
+        self._latenciesLock = Lock()
+        self.loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Runtime Worker")
+        self._thread = Thread(target=self._run, name="Runtime")
+
+    def install(self):
+        EventLoopRuntime.current = self
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_later(self._statsInterval, self._log_latencies)
+        self.loop.run_forever()
+
+    def is_running_in_loop(self):
+        return currentThread() is self._thread
+
+    def call_soon(self, callback):
+        self.loop.call_soon_threadsafe(callback)
+
+    def spawn(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def record_latency(self, name, wait, run):
+        with self._latenciesLock:
+            if name not in self._latencies:
+                self._latencies[name] = TaskLatency()
+            self._latencies[name].record(wait, run)
+
+    def get_latencies(self):
+        with self._latenciesLock:
+            return dict(self._latencies)
+
+    latencies = property(get_latencies)
+
+    def _log_latencies(self):
+        for name, latency in sorted(self.latencies.items()):
+            self._logger.log_info("Latency of %s: %s", name, latency)
+        self.loop.call_later(self._statsInterval, self._log_latencies)
+
+    @staticmethod
+    async def run_blocking(function, executor=None):
+        # Without a runtime there's no event loop to keep free so the function is simply called
+        runtime = EventLoopRuntime.current
+        if not runtime:
+            return function()
+        return await runtime.loop.run_in_executor(executor or runtime._executor, function)
+
+
+##
+# Scheduler
+##
+
+class ScheduledTask(object):
+
+    def __init__(self, deadline, task, key):
+        self.deadline = deadline
+        self.task = task
+        self.key = key
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler(object):
+
+    # Runs delayed tasks on a single thread instead of spawning a thread per timer. Tasks scheduled with a key
+    # replace a pending task with the same key (rescheduling) unless coalesce is set in which case the pending
+    # task is kept and the new one dropped. Tasks are expected to be short, longer work belongs on a SerialQueue.
+    # With an installed EventLoopRuntime, tasks are run from timers on its event loop instead.
+
+    def __init__(self, logger, name="Scheduler"):
+        self.name = name
+        self._logger = logger
+        self._heap = []
+        self._keys = {}
+        self._sequence = 0
+        self._condition = Condition()
+        self._runtime = EventLoopRuntime.current
+        self._timer = None
+        if not self._runtime:
+            Thread(target=self._run, name=name).start()
+
+    def schedule(self, delay, task, key=None, coalesce=False):
+        with self._condition:
+            pending = self._keys.get(key) if key is not None else None
+            if pending:
+                if coalesce:
+                    return pending
+                pending.cancel()
+
+            scheduledTask = ScheduledTask(monotonic() + delay, task, key)
+            if key is not None:
+                self._keys[key] = scheduledTask
+
+            # The sequence number keeps tasks with equal deadlines in scheduling order
+            self._sequence += 1
+            heappush(self._heap, (scheduledTask.deadline, self._sequence, scheduledTask))
+
+            if self._runtime:
+                self._runtime.call_soon(self._arm)
+            else:
+                self._condition.notify()
+
+            return scheduledTask
+
+    def cancel(self, key):
+        with self._condition:
+            pending = self._keys.pop(key, None)
+            if pending:
+                pending.cancel()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                scheduledTask, timeout = self._pop_due()
+                if not scheduledTask:
+                    self._condition.wait(timeout)
+                    continue
+            self._execute(scheduledTask)
+
+    def _arm(self):
+        if self._timer:
+            self._timer.cancel()
+        with self._condition:
+            _, timeout = self._pop_due(peek=True)
+        self._timer = self._runtime.loop.call_later(timeout, self._fire) if timeout is not None else None
+
+    def _fire(self):
+        self._timer = None
+        while True:
+            with self._condition:
+                scheduledTask, _ = self._pop_due()
+            if not scheduledTask:
+                break
+            self._execute(scheduledTask)
+        self._arm()
+
+    def _pop_due(self, peek=False):
+        # Returns the next task if it is due or otherwise the time until it will be (None if there's no task)
+        while self._heap and self._heap[0][2].cancelled:
+            heappop(self._heap)
+        if not self._heap:
+            return None, None
+        timeout = self._heap[0][0] - monotonic()
+        if timeout > 0 or peek:
+            return None, max(0, timeout)
+        _, _, scheduledTask = heappop(self._heap)
+        if self._keys.get(scheduledTask.key) is scheduledTask:
+            del self._keys[scheduledTask.key]
+        return scheduledTask, None
+
+    def _execute(self, scheduledTask):
+        started = monotonic()
+        try:
+            scheduledTask.task()
+        except Exception as e:
+            self._logger.log_error("Scheduled task %s failed: %s", scheduledTask.task, e)
+        if self._runtime:
+            self._runtime.record_latency(self.name, started - scheduledTask.deadline, monotonic() - started)
 
 
 ##
@@ -109,40 +1081,136 @@ class SerialQueue(object):
 
 class App(object):
 
-    def __init__(self, controller):
+    # Rendering is driven by changes: widgets notify their window when they need to be redrawn which in turn
+    # wakes up the render loop. Changes arriving within coalesceInterval are merged into a single frame and
+    # consecutive frames are at least minFrameInterval apart. With a snapshot, the first window starts from
+    # the snapshot's frame (which is expected to be on the display already) and what is displayed is saved
+    # to it periodically.
+
+    def __init__(self, controller, logger, minFrameInterval=0.03, coalesceInterval=0.01, snapshot=None):
         self.controllers = [controller]
-        self._queue = SerialQueue("main")
+        self.scheduler = Scheduler(logger)
+        self.minFrameInterval = minFrameInterval
+        self.coalesceInterval = coalesceInterval
+        self._queue = SerialQueue("main", logger)
+        self._runtime = EventLoopRuntime.current
+        self._needsDisplay = asyncio.Event() if self._runtime else Event()
+        self._displayExecutor = None
+        if self._runtime:
+            # SPI transfers get a worker of their own so that frames never wait for other blocking work
+            self._displayExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Runtime Display")
+        self._lastFrameTime = 0
+        self._logger = logger
+        self._wasDisplayedOnce = False
+        self._snapshot = snapshot
 
     def run(self):
-        self.controllers[-1].will_appear()
-        Thread(target=self._iterate).start()
+        if self._snapshot:
+            if self._snapshot.data:
+                self.controllers[-1].window.restore(self._snapshot.data)
+            self.scheduler.schedule(self._snapshot.interval, self._save_snapshot_periodically)
+        self._appear(self.controllers[-1])
+        if self._runtime:
+            self._runtime.spawn(self._render())
+        else:
+            Thread(target=self._iterate, name="App").start()
+
+    def set_needs_display(self):
+        if self._runtime:
+            self._runtime.call_soon(self._needsDisplay.set)
+        else:
+            self._needsDisplay.set()
+
+    def save_snapshot(self):
+        # Waits for the frame to be written, e.g. before shutting down
+        data = []
+        self._queue.run_sync(lambda: data.append(self.controllers[-1].window.get_displayed_data()))
+        if data[0]:
+            self._snapshot.save(data[0])
+
+    def _save_snapshot_periodically(self):
+        def save():
+            data = self.controllers[-1].window.get_displayed_data()
+            if data:
+                self._snapshot.save_async(data)
+        self._queue.run_async(save)
+        self.scheduler.schedule(self._snapshot.interval, self._save_snapshot_periodically)
 
     def _iterate(self):
         while True:
+            self._needsDisplay.wait()
+            sleep(max(self.coalesceInterval, self._lastFrameTime + self.minFrameInterval - time()))
+            self._needsDisplay.clear()
+            self._lastFrameTime = time()
             self._queue.run_sync(self._drawAndDisplay)
-            _, _, _ = select([], [], [], 1)
 
     def _drawAndDisplay(self):
+        started = monotonic()
         self.controllers[-1].window.draw()
         self.controllers[-1].window.display()
+        self._record_frame(monotonic() - started)
+
+    def _record_frame(self, duration):
+        metrics = Metrics.current
+        if metrics:
+            metrics.record_frame(duration)
+
+        if not self._wasDisplayedOnce:
+            self._wasDisplayedOnce = True
+            age = get_process_age()
+            if age is not None:
+                self._logger.log_info("First frame displayed %.3fs after start", age)
+                if metrics:
+                    metrics.record("boot.first_frame_ms", age * 1000)
+
+    async def _render(self):
+        # The event loop counterpart of _iterate. Drawing and displaying run as a single task on the main queue
+        # so that pushing and popping controllers can't touch the window while the SPI transfer is off the loop.
+        while True:
+            await self._needsDisplay.wait()
+            await asyncio.sleep(max(self.coalesceInterval, self._lastFrameTime + self.minFrameInterval - time()))
+            self._needsDisplay.clear()
+            self._lastFrameTime = time()
+            displayed = asyncio.get_running_loop().create_future()
+            self._queue.run_async(lambda: self._draw_and_display_async(displayed))
+            await displayed
+
+    async def _draw_and_display_async(self, displayed):
+        try:
+            started = monotonic()
+            window = self.controllers[-1].window
+            window.draw()
+            await EventLoopRuntime.run_blocking(window.display, self._displayExecutor)
+            self._runtime.record_latency("render", 0, monotonic() - started)
+            self._record_frame(monotonic() - started)
+        finally:
+            displayed.set_result(None)
 
     def push(self, controller):
         self._queue.run_async(lambda: self._push(controller))
 
     def _push(self, controller):
         if self.controllers:
-            self.controllers[-1].will_disappear()
+            self._disappear(self.controllers[-1])
         self.controllers.append(controller)
-        controller.will_appear()
+        self._appear(controller)
 
     def pop(self):
         self._queue.run_async(self._pop)
 
     def _pop(self):
-        current = self.controllers.pop()
-        current.will_disappear()
+        self._disappear(self.controllers.pop())
         if self.controllers:
-            self.controllers[-1].will_appear()
+            self._appear(self.controllers[-1])
+
+    def _appear(self, controller):
+        controller.window.renderer = self
+        controller.will_appear()
+        self.set_needs_display()
+
+    def _disappear(self, controller):
+        controller.window.renderer = None
+        controller.will_disappear()
 
 
 class Controller(object):
@@ -159,10 +1227,10 @@ class Controller(object):
         self.navigator.pop()
 
     def will_appear(self):
-        self.logger.log_info('%s will appear' % self)
+        self.logger.log_info('%s will appear', self)
 
     def will_disappear(self):
-        self.logger.log_info('%s will disappear' % self)
+        self.logger.log_info('%s will disappear', self)
         self.window.wasDisplayedOnce = False
 
 
@@ -175,44 +1243,144 @@ class Window(object):
         self._layer = Image.new("RGB", (driver.width, driver.height), "black")
         self._context = ImageDraw.Draw(self._layer)
         self._widgets = []
-        self._dirtyFrames = set()
+        self._framebuffer = Framebuffer(driver.width, driver.height)
+        self._panel = Framebuffer(driver.width, driver.height)
+        self._dirtyRegion = DirtyRegion(driver.costModel)
+        self._scrolls = []
+        self._widgetDrawTime = 0
         self.wasDisplayedOnce = False
+        self.renderer = None
 
     def add_widget(self, widget):
+        widget.parent = self
         self._widgets.append(widget)
 
+    def set_needs_display(self):
+        if self.renderer:
+            self.renderer.set_needs_display()
+
+    def restore(self, data):
+        # Takes data the display already shows as what was displayed last. The next display then only sends
+        # what differs from it.
+        self._panel.data[:] = data
+        self._dirtyRegion.add(Frame(0, 0, self._layer.width - 1, self._layer.height - 1))
+        self.wasDisplayedOnce = True
+
+    def get_displayed_data(self):
+        return bytes(self._panel.data) if self.wasDisplayedOnce else None
+
+    def scroll_region(self, frame, distance):
+        # Widgets report here when their contents moved up by distance rows so that the display can shift what
+        # it already shows instead of receiving all of it again
+        self._scrolls.append((frame, distance))
+
     def draw(self):
         t1 = time()
+        self._widgetDrawTime = 0
         self._draw(self._widgets)
-        self._logger.log_info("Drawing of window %s finished in %.3fs" % (self, time() - t1))
+        duration = time() - t1
+        self._logger.log_debug("Drawing of window %s finished in %.3fs", self, duration)
+
+        # Walking the tree is whatever time wasn't spent in the widgets' draw methods
+        metrics = Metrics.current
+        if metrics:
+            metrics.record("draw.walk_ms", (duration - self._widgetDrawTime) * 1000)
+            metrics.record("draw.widgets_ms", self._widgetDrawTime * 1000)
             
 
     def _draw(self, widgets):
         for widget in widgets:
             if widget.hidden:
+                if widget.needsRedraw:
+                    self._logger.log_debug("Clearing hidden widget %s", widget)
+                    self._context.rectangle(widget.frame.corners, fill="black")
+                    self._dirtyRegion.add(widget.frame)
+                    widget.needsRedraw = False
+                    widget.wasDrawnOnce = False
                 continue
             if widget.needsRedraw:
-                self._logger.log_info("Drawing widget %s" % widget)
+                self._logger.log_debug("Drawing widget %s", widget)
+                t1 = time()
                 widget.draw(self._layer, self._context)
-                self._dirtyFrames.add(widget.frame)
+                self._widgetDrawTime += time() - t1
+                if widget.dirtyFrame:
+                    self._dirtyRegion.add(widget.dirtyFrame)
             else:
                 self._draw(widget.children)
 
     def display(self):
-        # The lower boundary for displaying even small images is around 0.05s while refreshing the whole display
-        # takes around 0.25s. Consequently, when at least 5 subareas have to be re-displayed, a full display
-        # refresh is faster (or at least equal in performance).
-        if not self.wasDisplayedOnce or len(self._dirtyFrames) > 4:
+        fullFrame = Frame(0, 0, self._layer.width - 1, self._layer.height - 1)
+
+        if not self.wasDisplayedOnce:
             t1 = time()
-            self._driver.display(self._layer)
-            self._logger.log_info("Display of full layer of window %s finished in %.3fs" % (self, time() - t1))
-        else:
-            for frame in self._dirtyFrames:
-                t1 = time()
-                self._driver.display(self._layer.crop(frame.corners), x=frame.x0, y=frame.y0)
-                self._logger.log_info("Display of dirty frame %s of window %s finished in %.3fs" % (frame, self, time() - t1))
-        self._dirtyFrames.clear()
-        self.wasDisplayedOnce = True
+            self._scrolls = []
+            self._driver.reset_scroll()
+            data = self._framebuffer.update(self._layer, fullFrame)
+            t2 = time()
+            self._driver.display(data, fullFrame)
+            self._panel.copy(self._framebuffer, fullFrame)
+            t3 = time()
+            self._logger.log_debug("Display of full layer of window %s finished in %.3fs", self, t3 - t1)
+            self._record_display(t2 - t1, 0, t3 - t2, [fullFrame])
+            self._dirtyRegion.clear()
+            self.wasDisplayedOnce = True
+            return
+
+        # The dirty frames are converted and compared against what was last sent to the panel so that only the
+        # pixels that actually changed are transmitted. Nearby changes are merged into bounding rectangles
+        # whenever that is cheaper than sending them separately. If the remaining rectangles are still more
+        # expensive to send than the whole layer, a full display refresh is done instead.
+        self._scroll()
+
+        costModel = self._driver.costModel
+        changes = DirtyRegion(costModel)
+        convertTime = 0
+        diffTime = 0
+        for frame in self._dirtyRegion.coalesce():
+            t1 = time()
+            self._framebuffer.update(self._layer, frame)
+            t2 = time()
+            for change in self._framebuffer.diff(self._panel, frame):
+                changes.add(change)
+            convertTime += t2 - t1
+            diffTime += time() - t2
+        self._dirtyRegion.clear()
+
+        frames = changes.coalesce()
+        if costModel.cost(frames) >= costModel.cost([fullFrame]):
+            frames = [fullFrame]
+
+        transferTime = 0
+        for frame in frames:
+            t1 = time()
+            self._driver.display(self._framebuffer.get_region(frame), frame)
+            self._panel.copy(self._framebuffer, frame)
+            duration = time() - t1
+            transferTime += duration
+            self._logger.log_debug("Display of changed frame %s of window %s finished in %.3fs", frame, self, duration)
+
+        self._record_display(convertTime, diffTime, transferTime, frames)
+
+    def _record_display(self, convertTime, diffTime, transferTime, frames):
+        metrics = Metrics.current
+        if metrics:
+            metrics.record("display.convert_ms", convertTime * 1000)
+            metrics.record("display.diff_ms", diffTime * 1000)
+            metrics.record("display.spi_ms", transferTime * 1000)
+            metrics.record("display.rects", len(frames))
+            metrics.record("display.bytes", sum(frame.area for frame in frames) * 2)
+
+    def _scroll(self):
+        # After scrolling the display, the panel's shadow is shifted the same way so that the diff only finds
+        # the rows that were newly exposed
+        scrolls = self._scrolls
+        self._scrolls = []
+        if not scrolls or any(frame.corners != scrolls[0][0].corners for frame, _ in scrolls):
+            return
+        frame = scrolls[0][0]
+        distance = sum(distance for _, distance in scrolls)
+        if distance and self._driver.scroll(frame, distance):
+            self._panel.scroll(frame, distance)
 
 
 class Frame(object):
@@ -228,21 +1396,114 @@ class Frame(object):
 
         self.corners = [self.x0, self.y0, self.x1, self.y1]
 
+        # PIL's crop box excludes the right and lower edge
+        self.crop_box = (self.x0, self.y0, self.x1 + 1, self.y1 + 1)
+
     def __str__(self):
         return "%s" % self.corners
 
+    def get_area(self):
+        return self.width * self.height
+
+    area = property(get_area)
+
+    def union(self, other):
+        return Frame(min(self.x0, other.x0), min(self.y0, other.y0), max(self.x1, other.x1), max(self.y1, other.y1))
+
+    def contains(self, other):
+        return self.x0 <= other.x0 and self.y0 <= other.y0 and self.x1 >= other.x1 and self.y1 >= other.y1
+
+
+class DirtyRegion(object):
+
+    def __init__(self, costModel):
+        self._costModel = costModel
+        self._frames = []
+
+    def __len__(self):
+        return len(self._frames)
+
+    def add(self, frame):
+        if any(existing.contains(frame) for existing in self._frames):
+            return
+        self._frames = [existing for existing in self._frames if not frame.contains(existing)]
+        self._frames.append(frame)
+
+    def clear(self):
+        self._frames = []
+
+    def coalesce(self):
+        # Greedily merge the pair of frames whose bounding rectangle saves the most transfer time until no
+        # merge pays off anymore. This catches overlapping frames as well as frames that are merely close to
+        # each other because the saved per-transfer overhead outweighs the extra pixels in between.
+        frames = list(self._frames)
+        while len(frames) > 1:
+            best = None
+            for i in range(len(frames)):
+                for j in range(i + 1, len(frames)):
+                    union = frames[i].union(frames[j])
+                    saving = self._costModel.cost([frames[i], frames[j]]) - self._costModel.cost([union])
+                    if saving >= 0 and (not best or saving > best[0]):
+                        best = (saving, i, j, union)
+            if not best:
+                break
+            _, i, j, union = best
+            del frames[j]
+            frames[i] = union
+            frames = [frame for k, frame in enumerate(frames) if k == i or not union.contains(frame)]
+        return frames
+
 
 class Widget(object):
 
+    # Subclasses may change their state (and thus need a redraw) before calling the initializer
+    parent = None
+
     def __init__(self, frame):
         self.frame = frame
+        self.dirtyFrame = frame
         self.wasDrawnOnce = False
         self.needsRedraw = True
-        self.hidden = False
+        self._hidden = False
         self.children = []
 
+    def add_child(self, widget):
+        widget.parent = self
+        self.children.append(widget)
+
+    def get_needs_redraw(self):
+        return self._needsRedraw
+
+    def set_needs_redraw(self, needsRedraw):
+        self._needsRedraw = needsRedraw
+        if needsRedraw:
+            self.set_needs_display()
+
+    needsRedraw = property(get_needs_redraw, set_needs_redraw)
+
+    def get_hidden(self):
+        return self._hidden
+
+    def set_hidden(self, hidden):
+        if hidden != self._hidden:
+            self._hidden = hidden
+            self.needsRedraw = True
+
+    hidden = property(get_hidden, set_hidden)
+
+    def set_needs_display(self):
+        if self.parent:
+            self.parent.set_needs_display()
+
+    def scroll_region(self, frame, distance):
+        if self.parent:
+            self.parent.scroll_region(frame, distance)
+
     def draw(self, layer, context):
+        # Widgets that only redraw parts of themselves report the changed area in dirtyFrame (or None when
+        # nothing changed at all)
         self.needsRedraw = False
+        self.dirtyFrame = self.frame
         if self.wasDrawnOnce:
             context.rectangle(self.frame.corners, fill="black")
         else:
@@ -260,6 +1521,8 @@ class TextAlignment(Enum):
 
 class TextWidget(Widget):
 
+    cache = TextCache()
+
     def __init__(self, frame, font, color, text="", alignment=TextAlignment.LEFT):
         self._text = text
         self._font = font
@@ -276,19 +1539,23 @@ class TextWidget(Widget):
 
     text = property(get_text, set_text)
 
-    def draw(self, layer, context):
-        super().draw(layer, context)
+    def get_color(self):
+        return self._color
 
-        if self._alignment == TextAlignment.LEFT:
-            x = self.frame.x0
-        elif self._alignment == TextAlignment.RIGHT:
-            size = context.textsize(self._text, self._font)
-            x = self.frame.x1 + 1 - size[0]
-        elif self._alignment == TextAlignment.CENTER:
-            size = context.textsize(self._text, self._font)
-            x = self.frame.x0 + round((self.frame.width - size[0]) / 2.0)
+    def set_color(self, color):
+        self._color = color
+        self.needsRedraw = True
 
-        context.text((x, self.frame.y0), self._text, font=self._font, fill=self._color)
+    color = property(get_color, set_color)
+
+    def draw(self, layer, context):
+        # The cached bitmap covers the whole frame so there's no need to clear it beforehand
+        self.needsRedraw = False
+        self.dirtyFrame = self.frame
+        self.wasDrawnOnce = True
+
+        bitmap = self.cache.get(self._text, self._font, self._color, self._alignment, self.frame.width, self.frame.height)
+        layer.paste(bitmap, (self.frame.x0, self.frame.y0))
 
 
 class HRule(Widget):
@@ -329,12 +1596,18 @@ class ImageWidget(Widget):
 
 class ProgressBar(Widget):
 
+    # As long as the text stays the same, a progress change only repaints the columns between the previously
+    # drawn and the new fill level. The text is repainted as well if those columns overlap it.
+
     def __init__(self, frame, progress, text, font, color):
         super().__init__(frame)
         self.progress = progress
         self._text = text
         self._font = font
         self._color = color
+        self._drawnFillEnd = None
+        self._drawnText = None
+        self._textFrame = None
 
     def get_progress(self):
         return self._progress
@@ -354,27 +1627,80 @@ class ProgressBar(Widget):
 
     text = property(get_text, set_text)
 
+    def get_steps(self):
+        # The number of columns the fill level can advance by
+        return self.frame.x1 - 1 - self.frame.x0 - 1
+
+    steps = property(get_steps)
+
     def draw(self, layer, context):
-        super().draw(layer, context)
+        fillEnd = self._get_fill_end()
+
+        if self.wasDrawnOnce and self._drawnText == self._text and self._drawnFillEnd is not None:
+            self.needsRedraw = False
+            self._draw_fill_change(context, self._drawnFillEnd, fillEnd)
+        else:
+            super().draw(layer, context)
+            context.rectangle(self.frame.corners, outline=self._color)
+            if fillEnd > self.frame.x0:
+                context.rectangle([self.frame.x0 + 1, self.frame.y0 + 1, fillEnd, self.frame.y1 - 1], fill=self._color)
+            self._draw_text(context)
+
+        self._drawnFillEnd = fillEnd
+        self._drawnText = self._text
+
+    def _get_fill_end(self):
+        # The last filled column or x0 if nothing is filled
+        if self._progress <= 0:
+            return self.frame.x0
+        return self.frame.x0 + 1 + round(self._progress / 100 * self.steps)
+
+    def _draw_fill_change(self, context, oldFillEnd, newFillEnd):
+        if oldFillEnd == newFillEnd:
+            self.dirtyFrame = None
+            return
+
+        x0 = min(oldFillEnd, newFillEnd) + 1
+        x1 = max(oldFillEnd, newFillEnd)
+
+        overlapsText = self._textFrame and x0 <= self._textFrame.x1 and x1 >= self._textFrame.x0
+        if overlapsText:
+            x0 = min(x0, self._textFrame.x0)
+            x1 = max(x1, self._textFrame.x1)
 
-        context.rectangle(self.frame.corners, outline=self._color)
+        y0 = self.frame.y0 + 1
+        y1 = self.frame.y1 - 1
 
-        if self._progress > 0:
-            offset = self.frame.x0 + 1 + round(self._progress / 100 * (self.frame.x1 - 1 - self.frame.x0 - 1))
-            context.rectangle([self.frame.x0 + 1, self.frame.y0 + 1, offset, self.frame.y1 -1], fill=self._color)
-        
+        context.rectangle([x0, y0, x1, y1], fill="black")
+        if newFillEnd >= x0:
+            context.rectangle([x0, y0, min(x1, newFillEnd), y1], fill=self._color)
+        if overlapsText:
+            self._draw_text(context)
+
+        self.dirtyFrame = Frame(x0, y0, x1, y1)
+
+    def _draw_text(self, context):
+        if not self._text:
+            self._textFrame = None
+            return
         size = context.textsize(self._text, self._font)
         x = self.frame.x0 + round((self.frame.width - size[0]) / 2.0)
         y = self.frame.y0 + round((self.frame.height - size[1]) / 2.0)
+        # The text frame is confined to the interior so that repainting it never touches the outline
+        self._textFrame = Frame(max(x, self.frame.x0 + 1), y, min(x + size[0] - 1, self.frame.x1 - 1), y + size[1] - 1)
         context.text((x, y), self._text, font=self._font, fill=0xffffff)
 
 
 class VolumeBar(Widget):
 
+    # The segments that make up the level are diffed against the previously drawn ones so that a volume step
+    # only repaints the segments that were added or removed.
+
     def __init__(self, frame, color, volumeColors, volume=0):
         self.volume = volume
         self._color = color
         self._volumeColors = volumeColors
+        self._drawnSegments = None
         super().__init__(frame)
 
     def get_volumne(self):
@@ -387,13 +1713,45 @@ class VolumeBar(Widget):
     volume = property(get_volumne, set_volume)
 
     def draw(self, layer, context):
-        super().draw(layer, context)
+        segments = self._get_segments()
 
-        context.rectangle(self.frame.corners, outline=self._color)
+        if self.wasDrawnOnce and self._drawnSegments is not None:
+            self.needsRedraw = False
+            self._draw_segment_change(context, self._drawnSegments, segments)
+        else:
+            super().draw(layer, context)
+            context.rectangle(self.frame.corners, outline=self._color)
+            for corners, color in segments:
+                context.rectangle(corners, fill=color)
 
-        if self._volume == 0:
+        self._drawnSegments = segments
+
+    def _draw_segment_change(self, context, oldSegments, newSegments):
+        removed = [segment for segment in oldSegments if segment not in newSegments]
+        added = [segment for segment in newSegments if segment not in oldSegments]
+
+        for corners, _ in removed:
+            context.rectangle(corners, fill="black")
+        for corners, color in added:
+            context.rectangle(corners, fill=color)
+
+        changed = [corners for corners, _ in removed + added]
+        if not changed:
+            self.dirtyFrame = None
             return
 
+        self.dirtyFrame = Frame(
+            min(corners[0][0] for corners in changed),
+            min(corners[0][1] for corners in changed),
+            max(corners[1][0] for corners in changed),
+            max(corners[1][1] for corners in changed))
+
+    def _get_segments(self):
+        segments = []
+
+        if self._volume == 0:
+            return segments
+
         inset = 3
         maxHeight = self.frame.height - 2 * inset
         minY = self.frame.y0 + inset + round((1 - self._volume / 100) * (maxHeight - 1))
@@ -411,15 +1769,113 @@ class VolumeBar(Widget):
             ratio = (self.frame.y1 - inset - segmentOffset + 1) / (self.frame.height - 2 * inset)
             color = self._volumeColors[ceil(ratio * len(self._volumeColors)) - 1]
 
-            context.rectangle([(self.frame.x0 + inset, segmentOffset), (self.frame.x1 - inset, y)], fill=color)
+            segments.append((((self.frame.x0 + inset, segmentOffset), (self.frame.x1 - inset, y)), color))
             y -= spacing + segmentHeight
 
         # Due to the rounding the last segment will usually be smaller in height. In reality this should
         # rarely matter though because you'd hardly listen at full volume.
         if self._volume == 100:
-            context.rectangle([
-                (self.frame.x0 + inset, self.frame.y0 + inset),
-                (self.frame.x1 - inset, max(self.frame.y0 + inset, y))], fill=self._volumeColors[-1])
+            segments.append((
+                ((self.frame.x0 + inset, self.frame.y0 + inset), (self.frame.x1 - inset, max(self.frame.y0 + inset, y))),
+                self._volumeColors[-1]))
+
+        return segments
+
+
+class ListWidget(Widget):
+
+    # Only the visible rows exist as widgets. While scrolling they are recycled by handing them the entries of
+    # their new rows so that the cost of drawing doesn't depend on the length of the list. Entries are pulled
+    # lazily from a data source which provides count and get_row(row). Scrolling is also reported to the
+    # window so that lists spanning the whole width of the display can be scrolled in hardware.
+
+    def __init__(self, frame, rowHeight, font, color, selectionColor, rowText=lambda entry: entry):
+        super().__init__(frame)
+        self._rowHeight = rowHeight
+        self._color = color
+        self._selectionColor = selectionColor
+        self._rowText = rowText
+        self._dataSource = None
+        self._offset = 0
+        self._selection = 0
+
+        for i in range(frame.height // rowHeight):
+            y0 = frame.y0 + i * rowHeight
+            self.add_child(TextWidget(
+                frame=Frame(frame.x0, y0, frame.x1, y0 + rowHeight - 1),
+                font=font,
+                color=color))
+
+    def get_data_source(self):
+        return self._dataSource
+
+    def set_data_source(self, dataSource):
+        self._dataSource = dataSource
+        self._offset = 0
+        self._selection = 0
+        self.reload()
+
+    dataSource = property(get_data_source, set_data_source)
+
+    def get_count(self):
+        return self._dataSource.count if self._dataSource else 0
+
+    count = property(get_count)
+
+    def get_visible_rows(self):
+        return len(self.children)
+
+    visibleRows = property(get_visible_rows)
+
+    def get_offset(self):
+        return self._offset
+
+    offset = property(get_offset)
+
+    def get_selection(self):
+        return self._selection
+
+    def set_selection(self, selection):
+        # The list scrolls just far enough to keep the selected row visible
+        self._selection = min(max(0, selection), max(0, self.count - 1))
+        if self._selection < self._offset:
+            self._scroll_to(self._selection)
+        elif self._selection >= self._offset + self.visibleRows:
+            self._scroll_to(self._selection - self.visibleRows + 1)
+        self._update_rows()
+
+    selection = property(get_selection, set_selection)
+
+    def get_selected_entry(self):
+        return self._dataSource.get_row(self._selection) if self.count else None
+
+    selectedEntry = property(get_selected_entry)
+
+    def move_selection(self, delta):
+        self.selection = self._selection + delta
+
+    def reload(self):
+        # Needs to be called when the data source's rows changed, e.g. after narrowing a search
+        self._offset = min(self._offset, max(0, self.count - self.visibleRows))
+        self.selection = self._selection
+
+    def _scroll_to(self, offset):
+        if self.wasDrawnOnce:
+            rows = self.children[0].frame.union(self.children[-1].frame)
+            self.scroll_region(rows, (offset - self._offset) * self._rowHeight)
+        self._offset = offset
+
+    def _update_rows(self):
+        count = self.count
+        for i, widget in enumerate(self.children):
+            row = self._offset + i
+            text = self._rowText(self._dataSource.get_row(row)) if row < count else ""
+            color = self._selectionColor if row == self._selection else self._color
+            # Rows whose content stays the same aren't redrawn
+            if widget.text != text:
+                widget.text = text
+            if widget.color != color:
+                widget.color = color
 
 
 class PlayPauseIcon(Widget):
@@ -467,8 +1923,8 @@ class PlayPauseIcon(Widget):
         center = round((x1 + x0) / 2)
 
         context.rectangle([
-            (center - barWidth, y0),
-            (center - 2 * barWidth + 1, y1)], fill=self._color)
+            (center - 2 * barWidth + 1, y0),
+            (center - barWidth, y1)], fill=self._color)
         context.rectangle([
             (center + barWidth, y0),
             (center + 2 * barWidth - 1, y1)], fill=self._color)
@@ -523,9 +1979,10 @@ class PreviousNextIcon(Widget):
             (transform(x1 - triangleWidth), y0),
             (transform(x0 + barWidth), round((y1 + y0) / 2)),
             (transform(x1 - triangleWidth), y1)], fill=self._color)
+        barX0, barX1 = sorted([transform(x0), transform(x0 + barWidth - 1)])
         context.rectangle([
-            (transform(x0), y0),
-            (transform(x0 + barWidth - 1), y1)], fill=self._color)
+            (barX0, y0),
+            (barX1, y1)], fill=self._color)
 
 
 class ToolbarButtonType(Enum):
@@ -546,7 +2003,7 @@ class ToolbarButton(Widget):
             font=theme.get_font(14),
             color=theme.mainColor,
             alignment=TextAlignment.CENTER)
-        self.children.append(self.label)
+        self.add_child(self.label)
 
         iconFrame = Frame(frame.x0, frame.y0 + 22, frame.x1, frame.y1)
 
@@ -557,7 +2014,7 @@ class ToolbarButton(Widget):
         elif button_type == ToolbarButtonType.NEXT:
             self.icon = PreviousNextIcon(frame=iconFrame, color=theme.mainColor, previous=False)
 
-        self.children.append(self.icon)
+        self.add_child(self.icon)
 
 
 ##
@@ -648,7 +2105,7 @@ class PlayingWindow(Window):
 
 class PlayingWindowController(Controller):
 
-    def __init__(self, theme, driver, navigator, logger, network, mpdMonitor, mpdService):
+    def __init__(self, theme, driver, navigator, logger, network, mpdMonitor, mpdService, coverCache, library, buttons):
         super().__init__(PlayingWindow(theme, driver, logger), navigator, logger)
 
         self.theme = theme
@@ -658,18 +2115,32 @@ class PlayingWindowController(Controller):
         self.network = network
         self.mpdMonitor = mpdMonitor
         self.mpdService = mpdService
+        self.coverCache = coverCache
+        self.library = library
+        self.buttons = buttons
 
-        self.window.ipLabel.text = network.ip
-        self.window.ssidLabel.text = network.ssid
 
-        self._progressTimer = None
+        self._progressStart = None
+        self._progressDuration = None
+        # Stopping the timer happens on the monitor's queue while ticks run on the scheduler. Every stop starts
+        # a new generation so that a tick that's already running neither shows stale progress nor reschedules.
+        self._progressGeneration = 0
+        self._progressLock = Lock()
 
         mpdMonitor.mixerListeners.append(self)
         mpdMonitor.playerListeners.append(self)
+        mpdMonitor.nextSongListeners.append(self)
+        mpdService.volumeListeners.append(self)
+        buttons.listeners.append(self)
+        network.listeners.append(self)
 
     def __del__(self):
         self.mpdMonitor.mixerListeners.remove(self)
         self.mpdMonitor.playerListeners.remove(self)
+        self.mpdMonitor.nextSongListeners.remove(self)
+        self.mpdService.volumeListeners.remove(self)
+        self.buttons.listeners.remove(self)
+        self.network.listeners.remove(self)
 
     def will_appear(self):
         super().will_appear()
@@ -677,11 +2148,13 @@ class PlayingWindowController(Controller):
         self._update_current_song()
         self._update_volume()
         self._update_state_and_progress()
+        self._update_network()
 
         self.mpdMonitor.start()
+        self.network.refresh()
 
-        controller = LibraryWindowController(self.theme, self.driver, self.navigator, self.logger, self.mpdService)
-        Timer(3, lambda: self.navigator.push(controller)).start()
+        controller = LibraryWindowController(self.theme, self.driver, self.navigator, self.logger, self.library)
+        self.navigator.scheduler.schedule(3, lambda: self.navigator.push(controller))
 
     def will_disappear(self):
         super().will_disappear()
@@ -690,14 +2163,41 @@ class PlayingWindowController(Controller):
     def on_mixer_changed(self):
         self._update_volume()
 
+    def on_network_changed(self):
+        self._update_network()
+
+    def on_volume_requested(self, value):
+        self.window.volumeBar.volume = value
+
+    def on_button_pressed(self, button):
+        # The toolbar is flipped right away rather than waiting for the player event
+        if button == Button.PLAY_PAUSE:
+            play = self.window.playPauseButton.icon.play
+            self._show_playing(play)
+            if play:
+                self.mpdService.play()
+            else:
+                self.mpdService.pause()
+        elif button == Button.PREVIOUS:
+            self.mpdService.previous()
+        elif button == Button.NEXT:
+            self.mpdService.next()
+
     def on_player_changed(self):
         self._update_current_song()
         self._update_state_and_progress()
 
+    def on_next_song_changed(self):
+        song = self.mpdMonitor.nextSong
+        if song:
+            cover = self.window.cover.frame
+            self.coverCache.prefetch(song.path, (cover.width, cover.height))
+
     def _update_current_song(self):
         song = self.mpdMonitor.currentSong
         if song:
-            self.window.cover.image = self._load_cover(song.path)
+            cover = self.window.cover.frame
+            self.coverCache.load_async(song.path, (cover.width, cover.height), lambda image: self._show_cover(song.path, image))
             self.window.artistLabel.text = song.artist
             self.window.titleLabel.text = song.title
             year = song.date[:4] if song.date and len(song.date) > 4 else song.date
@@ -710,74 +2210,80 @@ class PlayingWindowController(Controller):
             self.window.albumLabel.text = None
             self.window.progressBar.hidden = True
 
-    def _load_cover(self, path):
-        if not path:
-            return None
-
-        fullPath = path
-        if not isfile(fullPath):
-            fullPath = "/mnt/%s" % path
-            if not isfile(fullPath):
-                fullPath = path.replace("USB/", "/media/")
-                if not isfile(fullPath):
-                    self.logger.log_error("Could not find directory to load cover for %s" % path)
-                    return None
-
-        directory = dirname(fullPath)
-        
-        for element in listdir(directory):
-            elementPath = "%s/%s" % (directory, element)
-            if isfile(elementPath) and splitext(element)[0] == "cover":
-                try:
-                    cover = Image.open(elementPath)
-                    self.logger.log_info("Loaded cover from %s" % elementPath)
-                    return cover
-                except IOError:
-                    self.logger.log_error("Could not load cover from %s" % elementPath)
+    def _show_cover(self, path, image):
+        # The song might have changed again while the cover was being loaded
+        song = self.mpdMonitor.currentSong
+        if song and song.path == path:
+            self.window.cover.image = image
 
-        self.logger.log_error("Could not find cover for %s" % path)
+    def _update_network(self):
+        self.window.ipLabel.text = self.network.ip
+        self.window.ssidLabel.text = self.network.ssid
 
     def _update_volume(self):
-        self.window.volumeBar.volume = self.mpdMonitor.volume
+        # While a change is on its way, mixer events of earlier changes would make the bar jump back
+        requested = self.mpdService.requestedVolume
+        self.window.volumeBar.volume = requested if requested is not None else self.mpdMonitor.volume
 
     def _update_state_and_progress(self):
         state = self.mpdMonitor.state
         if state == MpdState.PLAYING:
             self._start_progress_timer(self.mpdMonitor.elapsed, self.mpdMonitor.duration)
-            self.window.playPauseButton.icon.play = False
-            self.window.playPauseButton.label.text = "Pause"
+            self._show_playing(True)
         elif state == MpdState.PAUSED or state == MpdState.STOPPED:
             self._stop_progress_timer()
-            self.window.playPauseButton.icon.play = True
-            self.window.playPauseButton.label.text = "Play"
+            self._show_progress(self.mpdMonitor.elapsed, self.mpdMonitor.duration)
+            self._show_playing(False)
+
+    def _show_playing(self, playing):
+        # The button offers the opposite of what is going on
+        self.window.playPauseButton.icon.play = not playing
+        self.window.playPauseButton.label.text = "Pause" if playing else "Play"
+
+    def _show_progress(self, elapsed, duration):
+        if elapsed is None or not duration:
+            self.window.progressBar.progress = 0
+        else:
+            self.window.progressBar.progress = elapsed / duration * 100
 
     def _start_progress_timer(self, elapsed, duration):
         self._stop_progress_timer()
 
-        if not elapsed or not duration:
+        if elapsed is None or not duration:
             self.window.progressBar.progress = 0
             return
 
-        step = 10
-        exactProgress = elapsed / duration * 100
-        currentMark = round(exactProgress / step) * step
+        with self._progressLock:
+            self._progressStart = monotonic() - elapsed
+            self._progressDuration = duration
+            generation = self._progressGeneration
+        self._tick_progress(generation)
 
-        self.window.progressBar.progress = currentMark
+    def _tick_progress(self, generation):
+        with self._progressLock:
+            if generation != self._progressGeneration:
+                return
 
-        if currentMark == 100:
-            return
+            elapsed = monotonic() - self._progressStart
+            duration = self._progressDuration
 
-        nextMark = currentMark + step
-        interval = duration * nextMark / 100 - elapsed
+            self._show_progress(elapsed, duration)
+            if elapsed >= duration:
+                return
 
-        self._progressTimer = Timer(interval, lambda: self._start_progress_timer(elapsed + interval, duration))
-        self._progressTimer.start()
+            # The next tick is due when the fill level reaches the next column (the bar rounds to the nearest
+            # one)
+            steps = self.window.progressBar.steps
+            position = elapsed / duration * steps
+            nextPosition = floor(position + 0.5) + 0.5
+            delay = nextPosition / steps * duration - elapsed
+
+            self.navigator.scheduler.schedule(delay, lambda: self._tick_progress(generation), key=(self, "progress"))
 
     def _stop_progress_timer(self):
-        if not self._progressTimer:
-            return
-        self._progressTimer.cancel()
-        self._progressTimer = None
+        with self._progressLock:
+            self._progressGeneration += 1
+            self.navigator.scheduler.cancel((self, "progress"))
 
 
 class LibraryWindow(Window):
@@ -792,17 +2298,32 @@ class LibraryWindow(Window):
             color=self.theme.mainColor)
         self.add_widget(self.titleLabel)
 
+        self.add_widget(HRule(27, 240, theme.mainColor))
+
+        self.list = ListWidget(
+            frame=Frame(0, 32, 239, 319),
+            rowHeight=24,
+            font=self.theme.get_font(16),
+            color=self.theme.mainColor,
+            selectionColor=self.theme.selectionColor)
+        self.add_widget(self.list)
+
 
 class LibraryWindowController(Controller):
 
-    def __init__(self, theme, driver, navigator, logger, mpdService):
+    def __init__(self, theme, driver, navigator, logger, library):
         super().__init__(LibraryWindow(theme, driver, logger), navigator, logger)
-        self.mpdService = mpdService
+        self.library = library
 
     def will_appear(self):
         super().will_appear()
-        self.mpdService.fetch_artists(lambda artists: print(artists))
-        Timer(3, self.navigator.pop).start()
+        # Show the index right away and only reload it if a sync found changes in MPD's database
+        self.library.fetch_artist_index(self._show_artists)
+        self.library.sync(lambda changed: changed and self.library.fetch_artist_index(self._show_artists))
+        self.navigator.scheduler.schedule(3, self.navigator.pop)
+
+    def _show_artists(self, index):
+        self.window.list.dataSource = index.search()
 
 
 ##
@@ -811,8 +2332,8 @@ class LibraryWindowController(Controller):
 
 class PlayerApp(App):
 
-    def __init__(self, theme, driver, logger, network, mpdMonitor, mpdService):
-        super().__init__(PlayingWindowController(theme, driver, self, logger, network, mpdMonitor, mpdService))
+    def __init__(self, theme, driver, logger, network, mpdMonitor, mpdService, coverCache, library, buttons, snapshot=None):
+        super().__init__(PlayingWindowController(theme, driver, self, logger, network, mpdMonitor, mpdService, coverCache, library, buttons), logger, snapshot=snapshot)
 
 
 ##
@@ -821,21 +2342,36 @@ class PlayerApp(App):
 
 class NetworkService(object):
 
-    def __init__(self, logger):
+    # Probing forks iwgetid which takes a while on the Pi so it's done on a queue of its own and listeners are
+    # notified once the results are in. The results are reused for the refresh interval since the playing
+    # window asks for them every time it appears.
+
+    def __init__(self, logger, refreshInterval=60):
         self.logger = logger
+        self.refreshInterval = refreshInterval
         self._ip = None
-        self._ipTimestamp = None
         self._ssid = None
-        self._ssidTimestamp = None
+        self._refreshTimestamp = None
+        self._queue = SerialQueue("Network", logger, blocking=True)
+        self.listeners = []
+
+    def refresh(self):
+        if self._refreshTimestamp and time() - self._refreshTimestamp < self.refreshInterval:
+            return
+        self._refreshTimestamp = time()
+        self._queue.run_async(self._refresh)
+
+    def _refresh(self):
+        self._ip = self._get_ip()
+        self._ssid = self._get_ssid()
+        for listener in self.listeners:
+            listener.on_network_changed()
 
     def get_ip(self):
-        if not self._ipTimestamp or time() - self._ipTimestamp > 60:
-            self._ip = self._get_ip()
         return self._ip
 
     def _get_ip(self):
         self.logger.log_info("Determining current IP address")
-        self._ipTimestamp = time()
         s = socket(AF_INET, SOCK_DGRAM)
         try:
             s.connect(("10.255.255.255", 1))
@@ -848,14 +2384,15 @@ class NetworkService(object):
     ip = property(get_ip)
 
     def get_ssid(self):
-        if not self._ssidTimestamp or time() - self._ssidTimestamp > 60:
-            self._ssid = self._get_ssid()
         return self._ssid
 
     def _get_ssid(self):
         self.logger.log_info("Determining current SSID")
-        self._ssidTimestamp = time()
-        p = Popen(["iwgetid", "-r"], stdout = PIPE)
+        try:
+            p = Popen(["iwgetid", "-r"], stdout = PIPE)
+        except OSError as e:
+            self.logger.log_error("Could not run iwgetid: %s", e)
+            return None
         output, error = p.communicate()
         if p.returncode == 0:
             return output.decode('utf-8').strip()
@@ -865,28 +2402,519 @@ class NetworkService(object):
     ssid = property(get_ssid)
 
 
+##
+# Cover Cache
+##
+
+class CoverCache(object):
+
+    # Cover thumbnails are cached on disk keyed by album directory and cover modification time with a small
+    # in-memory LRU in front. Returning to a known album thus costs a single read of a small PNG instead of
+    # searching the album directory and decoding the full resolution cover.
+
+    def __init__(self, logger, directory="~/.cache/minifuzz/covers", maxEntries=16):
+        self._logger = logger
+        self._directory = expanduser(directory)
+        self._maxEntries = maxEntries
+        self._coverPaths = {}
+        self._thumbnails = OrderedDict()
+        self._lock = Lock()
+        self._queue = SerialQueue("Cover Loader", logger, blocking=True)
+
+    def prefetch(self, path, size):
+        # Loads the cover in the background so that it's readily available in memory once it's needed
+        self._queue.run_async(lambda: self.load(path, size))
+
+    def load_async(self, path, size, on_finished):
+        self._queue.run_async(lambda: on_finished(self.load(path, size)))
+
+    def load(self, path, size):
+        # Prefetches and loads share the serial queue so a load following a prefetch of the same album finds
+        # its thumbnail in memory
+        if not path:
+            return None
+
+        coverPath = self._find_cover(path)
+        if not coverPath:
+            return None
+
+        try:
+            mtime = getmtime(coverPath)
+        except OSError:
+            self._forget(path)
+            self._logger.log_error("Could not access cover %s", coverPath)
+            return None
+
+        directory = dirname(coverPath)
+        key = (directory, mtime, size)
+
+        with self._lock:
+            thumbnail = self._thumbnails.get(key)
+            if thumbnail:
+                self._thumbnails.move_to_end(key)
+                return thumbnail
+
+        thumbnailPath = join(self._directory, "%s-%d-%dx%d.png" % (
+            sha1(directory.encode("utf-8")).hexdigest(), mtime, size[0], size[1]))
+        thumbnail = self._read_thumbnail(thumbnailPath) or self._create_thumbnail(coverPath, thumbnailPath, size)
+        if not thumbnail:
+            return None
+
+        with self._lock:
+            self._thumbnails[key] = thumbnail
+            while len(self._thumbnails) > self._maxEntries:
+                self._thumbnails.popitem(last=False)
+
+        return thumbnail
+
+    def _forget(self, path):
+        with self._lock:
+            self._coverPaths.pop(dirname(path), None)
+
+    def _find_cover(self, path):
+        songDirectory = dirname(path)
+
+        with self._lock:
+            if songDirectory in self._coverPaths:
+                return self._coverPaths[songDirectory]
+
+        coverPath = self._search_cover(path)
+
+        # Misses aren't remembered as the media might just not be mounted yet
+        if coverPath:
+            with self._lock:
+                self._coverPaths[songDirectory] = coverPath
+
+        return coverPath
+
+    def _search_cover(self, path):
+        fullPath = path
+        if not isfile(fullPath):
+            fullPath = "/mnt/%s" % path
+            if not isfile(fullPath):
+                fullPath = path.replace("USB/", "/media/")
+                if not isfile(fullPath):
+                    self._logger.log_error("Could not find directory to load cover for %s", path)
+                    return None
+
+        directory = dirname(fullPath)
+
+        for element in listdir(directory):
+            elementPath = "%s/%s" % (directory, element)
+            if isfile(elementPath) and splitext(element)[0] == "cover":
+                return elementPath
+
+        self._logger.log_error("Could not find cover for %s", path)
+
+    def _read_thumbnail(self, thumbnailPath):
+        try:
+            thumbnail = Image.open(thumbnailPath)
+            thumbnail.load()
+            self._logger.log_info("Loaded cached cover from %s", thumbnailPath)
+            return thumbnail
+        except IOError:
+            return None
+
+    def _create_thumbnail(self, coverPath, thumbnailPath, size):
+        try:
+            cover = Image.open(coverPath)
+            # Lets the JPEG decoder scale down while decoding which is a lot faster than decoding at full size
+            cover.draft("RGB", size)
+            thumbnail = cover.convert("RGB")
+            thumbnail.thumbnail(size)
+            self._logger.log_info("Loaded cover from %s", coverPath)
+        except IOError:
+            self._logger.log_error("Could not load cover from %s", coverPath)
+            return None
+
+        try:
+            makedirs(self._directory, exist_ok=True)
+            # Writing to a temporary file first prevents leaving truncated thumbnails behind on power loss
+            temporaryPath = "%s.tmp" % thumbnailPath
+            thumbnail.save(temporaryPath, "PNG")
+            replace(temporaryPath, thumbnailPath)
+        except OSError:
+            self._logger.log_error("Could not cache cover thumbnail at %s", thumbnailPath)
+
+        return thumbnail
+
+
+##
+# MPD Connection Pool
+##
+
+class MpdConnectionPool(object):
+
+    # Connections shared by MpdService and MpdMonitor. The idle connection is kept apart since a connection
+    # waiting in idle can't be used for anything else. So is the control connection since playback control
+    # must not wait for a pooled connection held by a long request such as a library sync. Command connections
+    # are opened lazily up to the pool's size and handed out to one user at a time. Connections that fail are
+    # dropped and replaced on demand.
+
+    def __init__(self, logger, host="localhost", port=6600, size=3):
+        self._logger = logger
+        self._host = host
+        self._port = port
+        self._size = size
+        self._opened = 0
+        self._idleClient = None
+        self._controlClient = None
+        self._controlLock = Lock()
+        self._clients = Queue()
+        self._lock = Lock()
+
+    def get_idle_client(self):
+        with self._lock:
+            if not self._idleClient:
+                self._idleClient = self._connect()
+            return self._idleClient
+
+    idleClient = property(get_idle_client)
+
+    @contextmanager
+    def command(self):
+        from mpd import ConnectionError as MpdConnectionError
+
+        client = self._acquire()
+        try:
+            yield client
+        except (MpdConnectionError, OSError):
+            self._logger.log_error("Dropping broken MPD connection")
+            self._discard(client)
+            client = None
+            raise
+        finally:
+            if client:
+                self._clients.put(client)
+
+    def run(self, command):
+        with self.command() as client:
+            started = monotonic()
+            result = command(client)
+            self._record_round_trip(monotonic() - started)
+            return result
+
+    def control(self, command):
+        from mpd import ConnectionError as MpdConnectionError
+
+        # The control connection sits unused most of the time and MPD may have timed it out in the meantime.
+        # It's reopened and the command is sent once more then.
+        with self._controlLock:
+            for attempt in range(2):
+                if not self._controlClient:
+                    self._controlClient = self._connect()
+                try:
+                    started = monotonic()
+                    result = command(self._controlClient)
+                    self._record_round_trip(monotonic() - started)
+                    return result
+                except (MpdConnectionError, OSError):
+                    self._logger.log_error("Dropping broken MPD control connection")
+                    self._disconnect(self._controlClient)
+                    self._controlClient = None
+                    if attempt:
+                        raise
+
+    def batch(self, commands):
+        # Sends the commands as a single command list and returns their results in one round trip
+        with self.command() as client:
+            started = monotonic()
+            client.command_list_ok_begin()
+            try:
+                for command in commands:
+                    command(client)
+            finally:
+                results = client.command_list_end()
+            self._record_round_trip(monotonic() - started)
+            return results
+
+    def _record_round_trip(self, duration):
+        metrics = Metrics.current
+        if metrics:
+            metrics.record("mpd.rtt_ms", duration * 1000)
+
+    def _acquire(self):
+        try:
+            return self._clients.get_nowait()
+        except Empty:
+            pass
+
+        with self._lock:
+            canOpen = self._opened < self._size
+            if canOpen:
+                self._opened += 1
+
+        if not canOpen:
+            return self._clients.get()
+
+        try:
+            return self._connect()
+        except:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def _discard(self, client):
+        with self._lock:
+            self._opened -= 1
+        self._disconnect(client)
+
+    def _disconnect(self, client):
+        from mpd import ConnectionError as MpdConnectionError
+
+        try:
+            client.disconnect()
+        except (MpdConnectionError, OSError):
+            pass
+
+    def _connect(self):
+        from mpd import MPDClient
+
+        self._logger.log_info("Connecting to MPD at %s:%d", self._host, self._port)
+        client = MPDClient()
+        client.connect(self._host, self._port)
+        return client
+
+
 ##
 # MPD Service
 ##
 
 class MpdService(object):
 
-    def __init__(self, logger, host="localhost", port=6600):
+    def __init__(self, logger, pool):
         self._logger = logger
-        self._client = MPDClient()
-        self._queue = SerialQueue("MPD")
-        self._queue.run_async(lambda: self._client.connect(host, port))
+        self._pool = pool
+        self._queue = SerialQueue("MPD", logger, blocking=True)
+        # Playback control gets a queue, a worker and a connection of its own so that it never waits behind
+        # slower requests
+        self._controlQueue = SerialQueue("MPD Control", logger, blocking=True, dedicated=True)
+        self._requestedVolume = None
+        self.volumeListeners = []
 
-    def __del__(self):
-        self._queue.run_async(lambda: self._client.disconnect())
+    def get_requested_volume(self):
+        # The volume that was asked for but not yet set on MPD or None
+        return self._requestedVolume
+
+    requestedVolume = property(get_requested_volume)
 
     def change_volume(self, value):
-        self._logger.log_info("Changing volume to %i%%" % value)
-        self._queue.run_async(lambda: self._client.setvol(value))
+        # Moving the slider produces a stream of changes. Only the latest one is sent once MPD is free again
+        # while the listeners can already show it.
+        self._logger.log_debug("Changing volume to %i%%", value)
+        self._requestedVolume = value
+        for listener in self.volumeListeners:
+            listener.on_volume_requested(value)
+        self._queue.run_async(lambda: self._set_volume(value), key="setvol")
+
+    def play(self):
+        self._logger.log_info("Playing")
+        self._controlQueue.run_async(lambda: self._pool.control(lambda client: client.play()))
+
+    def pause(self):
+        self._logger.log_info("Pausing")
+        self._controlQueue.run_async(lambda: self._pool.control(lambda client: client.pause(1)))
+
+    def previous(self):
+        self._logger.log_info("Skipping to previous song")
+        self._controlQueue.run_async(lambda: self._pool.control(lambda client: client.previous()))
+
+    def next(self):
+        self._logger.log_info("Skipping to next song")
+        self._controlQueue.run_async(lambda: self._pool.control(lambda client: client.next()))
+
+    def _set_volume(self, value):
+        try:
+            self._pool.run(lambda client: client.setvol(value))
+        finally:
+            if self._requestedVolume == value:
+                self._requestedVolume = None
+
+
+##
+# Library Index
+##
+
+class PrefixSearch(object):
+
+    # Data source for a ListWidget over a PrefixIndex. Narrowing it down character by character is left until
+    # there's an input to enter them with.
+
+    def __init__(self, index):
+        self._index = index
+
+    def get_characters(self):
+        # Characters that entries start with, e.g. for offering them on the rotary encoder
+        return self._index.get_characters("")
+
+    def get_row(self, row):
+        return self._index.get_entry(row)
+
+    def get_count(self):
+        return len(self._index)
+
+    count = property(get_count)
+
+
+class PrefixIndex(object):
+
+    # Sorted array of case-folded keys next to the entries they belong to. Entries sharing a prefix form a
+    # contiguous range so their following characters can be found by bisecting.
 
-    def fetch_artists(self, on_finished):
-        self._logger.log_info("Fetching artists")
-        self._queue.run_async(lambda: on_finished(self._client.list("albumartist")))
+    _end = chr(0x10FFFF)
+
+    def __init__(self, entries, key=lambda entry: entry):
+        pairs = sorted(((key(entry).casefold(), entry) for entry in entries), key=lambda pair: pair[0])
+        self._keys = [pair[0] for pair in pairs]
+        self._entries = [pair[1] for pair in pairs]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def search(self):
+        return PrefixSearch(self)
+
+    def get_characters(self, prefix, lo=0, hi=None):
+        hi = len(self._keys) if hi is None else hi
+        characters = []
+        # Skip keys equal to the prefix and then jump from one following character to the next
+        i = bisect_right(self._keys, prefix, lo, hi)
+        while i < hi:
+            character = self._keys[i][len(prefix)]
+            characters.append(character)
+            i = bisect_right(self._keys, prefix + character + self._end, i, hi)
+        return characters
+
+    def get_entry(self, i):
+        return self._entries[i]
+
+
+class LibraryIndex(object):
+
+    # Local copy of MPD's database in SQLite so that browsing doesn't have to list the whole collection over
+    # the MPD connection each time. It is only synced when the db_update timestamp in MPD's stats changes and
+    # syncing only writes songs that were added or modified to keep writes to the SD card low. Reads use their
+    # own connection and queue so that browsing isn't held up by a running sync.
+
+    def __init__(self, logger, pool, path="~/.cache/minifuzz/library.sqlite"):
+        self._logger = logger
+        self._pool = pool
+        self._path = expanduser(path)
+        self._readQueue = SerialQueue("Library", logger, blocking=True)
+        self._syncQueue = SerialQueue("Library Sync", logger, blocking=True)
+        self._readConnection = None
+        self._syncConnection = None
+
+    def sync(self, on_finished=None):
+        def sync():
+            changed = self._sync()
+            if on_finished:
+                on_finished(changed)
+        self._syncQueue.run_async(sync)
+
+    def fetch_artist_index(self, on_finished):
+        self._read(lambda rows: on_finished(PrefixIndex(rows)),
+            "SELECT albumArtist FROM songs GROUP BY albumArtistKey")
+
+    def _read(self, on_finished, query):
+        def read():
+            if not self._readConnection:
+                self._readConnection = self._open()
+            on_finished([row[0] for row in self._readConnection.execute(query)])
+        self._readQueue.run_async(read)
+
+    def _open(self):
+        makedirs(dirname(self._path), exist_ok=True)
+        connection = sqlite_connect(self._path, check_same_thread=False)
+        # WAL lets the read connection keep going while a sync is writing
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS songs (
+                path TEXT PRIMARY KEY,
+                lastModified TEXT,
+                albumArtist TEXT,
+                albumArtistKey TEXT,
+                album TEXT,
+                albumKey TEXT,
+                title TEXT,
+                date TEXT,
+                disc INTEGER,
+                track INTEGER);
+            CREATE INDEX IF NOT EXISTS songsByAlbum ON songs (albumArtistKey, albumKey);""")
+        return connection
+
+    def _sync(self):
+        if not self._syncConnection:
+            self._syncConnection = self._open()
+        connection = self._syncConnection
+
+        dbUpdate = self._pool.run(lambda client: client.stats()).get("db_update")
+        row = connection.execute("SELECT value FROM meta WHERE key = 'db_update'").fetchone()
+        if row and row[0] == dbUpdate:
+            self._logger.log_info("Library index is up to date")
+            return False
+
+        t1 = time()
+        self._logger.log_info("Syncing library index")
+
+        known = dict(connection.execute("SELECT path, lastModified FROM songs"))
+        seen = set()
+        written = 0
+
+        with connection:
+            with self._pool.command() as client:
+                # Iterating keeps the client from building up the whole listing in memory
+                client.iterate = True
+                try:
+                    for entry in client.listallinfo():
+                        if "file" not in entry:
+                            continue
+                        path = entry["file"]
+                        seen.add(path)
+                        if path in known and known[path] == entry.get("last-modified"):
+                            continue
+                        connection.execute("INSERT OR REPLACE INTO songs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            self._make_row(entry))
+                        written += 1
+                finally:
+                    client.iterate = False
+
+            removed = [(path,) for path in known if path not in seen]
+            connection.executemany("DELETE FROM songs WHERE path = ?", removed)
+            connection.execute("INSERT OR REPLACE INTO meta VALUES ('db_update', ?)", (dbUpdate,))
+
+        self._logger.log_info("Synced library index in %.3fs (%d songs written, %d removed)",
+            time() - t1, written, len(removed))
+        return True
+
+    def _make_row(self, entry):
+        albumArtist = self._get_tag(entry, "albumartist") or self._get_tag(entry, "artist") or ""
+        album = self._get_tag(entry, "album") or ""
+        return (
+            entry["file"],
+            entry.get("last-modified"),
+            albumArtist,
+            albumArtist.casefold(),
+            album,
+            album.casefold(),
+            self._get_tag(entry, "title") or splitext(entry["file"].split("/")[-1])[0],
+            self._get_tag(entry, "date"),
+            self._get_number(entry, "disc"),
+            self._get_number(entry, "track"))
+
+    def _get_tag(self, entry, tag):
+        # Tags that occur multiple times come back as lists
+        value = entry.get(tag)
+        return value[0] if isinstance(value, list) else value
+
+    def _get_number(self, entry, tag):
+        # Track and disc numbers may look like "3/12"
+        value = self._get_tag(entry, tag)
+        try:
+            return int(value.split("/")[0]) if value else None
+        except ValueError:
+            return None
 
 
 ##
@@ -902,29 +2930,49 @@ class MpdState(Enum):
 
 class MpdSong(object):
 
-    def __init__(self, artist, album, title, date, path):
-        self.artist = artist
-        self.album = album
-        self.title = title
-        self.date = date
-        self.path = path
+    # Immutable record that is built once per queue entry and then shared
+
+    __slots__ = ("songid", "artist", "album", "title", "date", "path")
+
+    def __init__(self, songid, artist, album, title, date, path):
+        object.__setattr__(self, "songid", songid)
+        object.__setattr__(self, "artist", artist)
+        object.__setattr__(self, "album", album)
+        object.__setattr__(self, "title", title)
+        object.__setattr__(self, "date", date)
+        object.__setattr__(self, "path", path)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("MpdSong is immutable")
+
+    @staticmethod
+    def from_mpd(song):
+        return MpdSong(
+            songid=song.get("id"),
+            artist=song.get("artist"),
+            album=song.get("album"),
+            title=song.get("title"),
+            date=song.get("date"),
+            path=song.get("file"))
 
 
 class MpdMonitor(object):
 
-    def __init__(self, logger, host="localhost", port=6600):
+    def __init__(self, logger, pool, maxSongs=32):
         self._logger = logger
-        self._client = MPDClient()
+        self._pool = pool
+        self._client = None
         self._status = None
         self._currentSong = None
+        self._nextSong = None
+        self._songs = OrderedDict()
+        self._songsPlaylist = None
+        self._maxSongs = maxSongs
         self._stop = False
         self.mixerListeners = []
         self.playerListeners = []
-        self._queue = SerialQueue("MPD Monitor")
-        self._queue.run_async(lambda: self._client.connect(host, port))
-
-    def __del__(self):
-        self._queue.run_async(lambda: self._client.disconnect())
+        self.nextSongListeners = []
+        self._queue = SerialQueue("MPD Monitor", logger)
 
     def start(self):
         self._queue.run_async(self._idle)
@@ -932,51 +2980,114 @@ class MpdMonitor(object):
     def stop(self):
         self._stop = True
 
-    def _idle(self):
-        if self._update_status():
+    async def _idle(self):
+        # Only waiting for events happens on the event loop itself. Everything talking to MPD (including
+        # waiting for a pooled connection) is blocking and thus goes through run_blocking.
+        if await self._update_status():
             self._notify_mixer_listeners()
-        if self._update_current_song():
+        if await self._update_current_song():
             self._notify_player_listeners()
+        if await self._update_next_song():
+            self._notify_next_song_listeners()
+
+        self._client = await EventLoopRuntime.run_blocking(lambda: self._pool.idleClient)
 
         idling = False
         while self._client:
             if not idling:
-                self._logger.log_info("Starting MPD idle")
-                self._client.send_idle()
+                self._logger.log_debug("Starting MPD idle")
+                await EventLoopRuntime.run_blocking(self._client.send_idle)
                 idling = True
-            ready, _, _ = select([self._client], [], [], 1)
-            if ready:
-                self._logger.log_info("MPD idle loop interrupted with data available on %s" % ready)
-                self._handle_events(self._client.fetch_idle())
+            if await self._wait_for_data(1):
+                self._logger.log_debug("MPD idle loop interrupted with data available")
+                await self._handle_events(await EventLoopRuntime.run_blocking(self._client.fetch_idle))
                 idling = False
             if self._stop:
                 self._stop = False
                 if idling:
-                    self._logger.log_info("Stopping MPD idle")
-                    self._client.noidle()
+                    self._logger.log_debug("Stopping MPD idle")
+                    await EventLoopRuntime.run_blocking(self._client.noidle)
                 break
 
-    def _handle_events(self, events):
-        self._update_status()
-        for event in events:
-            if event == "mixer":
-                self._notify_mixer_listeners()
-            if event == "player":
-                self._update_current_song()
-                self._notify_player_listeners()
+    async def _wait_for_data(self, timeout):
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        loop.add_reader(self._client.fileno(), lambda: ready.done() or ready.set_result(True))
+        try:
+            return await asyncio.wait_for(ready, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            loop.remove_reader(self._client.fileno())
+
+    async def _handle_events(self, events):
+        await self._update_status()
+        if "mixer" in events:
+            self._notify_mixer_listeners()
+        if "player" in events:
+            await self._update_current_song()
+            self._notify_player_listeners()
+        if "player" in events or "playlist" in events:
+            # The next song is only resolved after the listeners have updated the screen for the current one
+            if await self._update_next_song():
+                self._notify_next_song_listeners()
 
-    def _update_status(self):
+    async def _update_status(self):
         old = self._status
-        self._status = self._client.status()
+        self._status = await EventLoopRuntime.run_blocking(lambda: self._pool.run(lambda client: client.status()))
+
+        # Song ids stay valid as long as the queue isn't modified which is reflected by its version
+        playlist = self._status.get("playlist")
+        if playlist != self._songsPlaylist:
+            self._songs.clear()
+            self._songsPlaylist = playlist
+
         return old != self._status
 
-    def _update_current_song(self):
+    async def _update_current_song(self):
+        # If the current song isn't known yet, the next one most likely isn't either. Both are fetched in a
+        # single round trip then.
         old = self._currentSong
-        if "songid" in self._status:
-            self._currentSong = self._client.playlistid(self._status["songid"])[0]
-        else:
-            self._currentSong = None
-        return old != self._currentSong
+        await self._fetch_songs([self._status.get("songid"), self._status.get("nextsongid")])
+        self._currentSong = self._get_song(self._status.get("songid"))
+        return old is not self._currentSong
+
+    async def _update_next_song(self):
+        old = self._nextSong
+        await self._fetch_songs([self._status.get("nextsongid")])
+        self._nextSong = self._get_song(self._status.get("nextsongid"))
+        return old is not self._nextSong
+
+    async def _fetch_songs(self, songids):
+        from mpd import CommandError
+
+        # Pausing, resuming and seeking keep the song ids and thus don't cause any metadata requests. Neither
+        # does advancing to the next song since it has been fetched ahead of time.
+        if not songids[0] or songids[0] in self._songs:
+            return
+
+        missing = [songid for songid in songids if songid and songid not in self._songs]
+        commands = [lambda client, songid=songid: client.playlistid(songid) for songid in missing]
+        try:
+            results = await EventLoopRuntime.run_blocking(lambda: self._pool.batch(commands))
+            songs = [MpdSong.from_mpd(result[0]) for result in results]
+        except (CommandError, IndexError) as e:
+            # The queue changed since the status was read. The songs stay unknown and the cache is dropped
+            # as the ids in it might be stale, too. The pending playlist event will fetch them again.
+            self._logger.log_error("Failed to fetch songs %s: %s", missing, e)
+            self._songs.clear()
+            return
+
+        for songid, song in zip(missing, songs):
+            self._songs[songid] = song
+        while len(self._songs) > self._maxSongs:
+            self._songs.popitem(last=False)
+
+    def _get_song(self, songid):
+        if not songid or songid not in self._songs:
+            return None
+        self._songs.move_to_end(songid)
+        return self._songs[songid]
 
     def _notify_mixer_listeners(self):
         for listener in self.mixerListeners:
@@ -986,6 +3097,10 @@ class MpdMonitor(object):
         for listener in self.playerListeners:
             listener.on_player_changed()
 
+    def _notify_next_song_listeners(self):
+        for listener in self.nextSongListeners:
+            listener.on_next_song_changed()
+
     def get_volume(self):
         if not self._status:
             return 0
@@ -1007,36 +3122,14 @@ class MpdMonitor(object):
     state = property(get_state)
 
     def get_current_song(self):
-        if not self._currentSong:
-            return None
-        return MpdSong(
-            artist=self._get_current_song_artist(),
-            album=self._get_current_song_album(),
-            title=self._get_current_song_title(),
-            date=self._get_current_song_date(),
-            path=self._get_current_song_path())
-
-    def _get_current_song_artist(self):
-        if self._currentSong and "artist" in self._currentSong:
-            return self._currentSong["artist"]
+        return self._currentSong
 
-    def _get_current_song_album(self):
-        if self._currentSong and "album" in self._currentSong:
-            return self._currentSong["album"]
-
-    def _get_current_song_title(self):
-        if self._currentSong and "title" in self._currentSong:
-            return self._currentSong["title"]
-
-    def _get_current_song_date(self):
-        if self._currentSong and "date" in self._currentSong:
-            return self._currentSong["date"]
+    currentSong = property(get_current_song)
 
-    def _get_current_song_path(self):
-        if self._currentSong and "file" in self._currentSong:
-            return self._currentSong["file"]
+    def get_next_song(self):
+        return self._nextSong
 
-    currentSong = property(get_current_song)
+    nextSong = property(get_next_song)
 
     def get_elapsed(self):
         if self._status and "elapsed" in self._status:
@@ -1057,55 +3150,182 @@ class MpdMonitor(object):
 
 class VolumeMonitor(object):
 
-    def __init__(self, logger, mpdService):
+    # Instead of polling the ADC, it converts continuously in window comparator mode and pulls its ALRT pin
+    # low once the slider leaves a window of 1% around the last value. The window is then moved to the new
+    # value. Until the slider moves again, nothing needs to run at all.
+
+    def __init__(self, logger, mpdService, gpio, alertPin=17, dataRate=128):
         self._logger = logger
         self._mpdService = mpdService
-        self._adc = ADS1115()
+        self._gpio = gpio
+        self._alertPin = alertPin
+        self._dataRate = dataRate
+        self._adc = None
         self._last_value = None
         self._max_value = 32767 * 3.3 / 4.096
-        self._stop = False
-        self._queue = SerialQueue("Volume Monitor")
+        self._step = self._max_value / 100
+        self._queue = SerialQueue("Volume Monitor", logger, blocking=True)
 
     def start(self):
-        self._queue.run_async(self._iterate)
+        self._queue.run_async(self._start)
 
     def stop(self):
-        self._stop = True
+        self._gpio.remove_event_detect(self._alertPin)
+        self._queue.run_async(lambda: self._adc.stop_adc())
 
-    def _iterate(self):
-        while not self._stop:
-            new_value = self._adc.read_adc(0, gain=1)
-            if not self._last_value or abs(new_value - self._last_value) >= self._max_value / 100:
-                self._last_value = new_value
-                percentage = max(0, min(100, round(new_value / self._max_value * 100)))
-                self._logger.log_info("Volume slider changed to %i%%" % percentage)
-                self._mpdService.change_volume(percentage)
-            sleep(0.2)
+    def _start(self):
+        from Adafruit_ADS1x15 import ADS1115
+
+        self._adc = ADS1115()
+        # ALRT is an open drain output and thus needs the pull-up
+        self._gpio.setup(self._alertPin, self._gpio.IN, pull_up_down=self._gpio.PUD_UP)
+        self._gpio.add_event_detect(self._alertPin, self._gpio.FALLING, callback=self._on_alert)
+        self._change_volume(self._adc.read_adc(0, gain=1))
+
+    def _on_alert(self, pin):
+        # Called on the GPIO thread. Alerts that come in while one is being handled are handled in one go.
+        metrics = Metrics.current
+        if metrics:
+            metrics.record_input()
+        self._queue.run_async(self._handle_alert, key="alert")
+
+    def _handle_alert(self):
+        # The pin only falls again after a conversion inside the new window. If the slider has moved on
+        # before that, the change would go unnoticed, so the latest conversion is checked after each move.
+        while True:
+            new_value = self._adc.get_last_result()
+            if abs(new_value - self._last_value) < self._step:
+                return
+            self._change_volume(new_value)
+            sleep(2 / self._dataRate)
+
+    def _change_volume(self, new_value):
+        self._last_value = new_value
+        self._adc.start_adc_comparator(
+            0,
+            min(32767, round(new_value + self._step)),
+            max(-32768, round(new_value - self._step)),
+            gain=1,
+            data_rate=self._dataRate,
+            traditional=False)
+        percentage = max(0, min(100, round(new_value / self._max_value * 100)))
+        self._logger.log_debug("Volume slider changed to %i%%", percentage)
+        self._mpdService.change_volume(percentage)
 
 
 ##
-# Main
+# Button Input
 ##
 
-logger = Logger()
-theme = Theme()
-driver = DisplayDriver(logger)
-network = NetworkService(logger)
+class Button(Enum):
+
+    PREVIOUS = 1
+    PLAY_PAUSE = 2
+    NEXT = 3
+
+
+class ButtonInput(object):
 
-mpdMonitor = MpdMonitor(logger)
-mpdService = MpdService(logger)
+    # Buttons pull their pin low when pressed. Contacts bounce for a few milliseconds which produces a burst
+    # of edges, so edges within the debounce interval of the last accepted press of the same pin are dropped.
+    # Unlike RPi.GPIO's bouncetime, the first edge is accepted right away. Listeners are called on the GPIO
+    # thread and should only hand off work.
+
+    def __init__(self, logger, gpio, pins={5: Button.PREVIOUS, 6: Button.PLAY_PAUSE, 13: Button.NEXT}, debounceInterval=0.05):
+        self._logger = logger
+        self._gpio = gpio
+        self._pins = pins
+        self._debounceInterval = debounceInterval
+        self._lastPresses = {}
+        self.listeners = []
 
-# volumeMonitor = VolumeMonitor(logger, mpdService)
-# volumeMonitor.start()
+    def start(self):
+        for pin in self._pins:
+            self._gpio.setup(pin, self._gpio.IN, pull_up_down=self._gpio.PUD_UP)
+            self._gpio.add_event_detect(pin, self._gpio.FALLING, callback=self._on_edge)
 
-# app = PlayerApp(theme, driver, logger, network, mpdMonitor, mpdService)
-# app.run()
+    def stop(self):
+        for pin in self._pins:
+            self._gpio.remove_event_detect(pin)
 
-def button_callback(foo):
-    print("HERE I AM")
-    print(foo)
+    def _on_edge(self, pin):
+        now = monotonic()
+        lastPress = self._lastPresses.get(pin)
+        if lastPress is not None and now - lastPress < self._debounceInterval:
+            return
+        # Spikes on the line are too short to still read as pressed
+        if self._gpio.input(pin):
+            return
+        self._lastPresses[pin] = now
+
+        metrics = Metrics.current
+        if metrics:
+            metrics.record_input()
+
+        button = self._pins[pin]
+        self._logger.log_info("Button %s pressed", button.name)
+        for listener in self.listeners:
+            listener.on_button_pressed(button)
+
+
+##
+# Main
+##
 
-#GPIO.setmode(GPIO.BOARD) # Use physical pin numbering
-GPIO.setup(22, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.add_event_detect(22, GPIO.FALLING, callback=button_callback)#, bouncetime=500)
-print("OK")
\ No newline at end of file
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Mini Fuzz music player")
+    parser.add_argument("--event-loop", action="store_true", help="run everything on a single asyncio event loop")
+    parser.add_argument("--metrics", action="store_true", help="serve frame, queue and MPD timings on a UNIX socket")
+    parser.add_argument("--log-level", choices=[level.name for level in LogLevel], default="INFO",
+        help="keep messages from this level on (debug messages are only written when sending SIGUSR1)")
+    args = parser.parse_args()
+
+    logger = Logger(level=LogLevel[args.log_level])
+    signal(SIGUSR1, lambda signum, frame: logger.dump())
+
+    # Sending SIGUSR2 starts sampling and sending it again writes the collapsed stacks
+    profiler = SamplingProfiler(logger)
+    signal(SIGUSR2, lambda signum, frame: profiler.toggle())
+
+    if args.metrics:
+        Metrics(logger).install()
+    if args.event_loop:
+        EventLoopRuntime(logger).install()
+
+    # Only what's needed for the first frame happens up front. The services merely set up their queues here
+    # and connect to MPD, probe the network or talk to the ADC on them once the app is running.
+    driver = ILI9341DisplayDriver(logger)
+
+    # The screen from before the restart is back before any widgets exist
+    snapshot = FrameSnapshot(logger)
+    if snapshot.load(driver.width, driver.height):
+        driver.display(snapshot.data, Frame(0, 0, driver.width - 1, driver.height - 1))
+
+    theme = Theme()
+
+    from RPi import GPIO
+    GPIO.setmode(GPIO.BCM)
+
+    network = NetworkService(logger)
+    mpdPool = MpdConnectionPool(logger)
+    mpdMonitor = MpdMonitor(logger, mpdPool)
+    mpdService = MpdService(logger, mpdPool)
+    coverCache = CoverCache(logger)
+    library = LibraryIndex(logger, mpdPool)
+    buttons = ButtonInput(logger, GPIO)
+
+    app = PlayerApp(theme, driver, logger, network, mpdMonitor, mpdService, coverCache, library, buttons, snapshot)
+    app.run()
+
+    def shut_down(signum, frame):
+        app.save_snapshot()
+        # The writer thread dies with the process so the last messages are written here
+        logger.flush()
+        _exit(0)
+
+    signal(SIGTERM, shut_down)
+
+    library.sync()
+    buttons.start()
+    volumeMonitor = VolumeMonitor(logger, mpdService, GPIO)
+    volumeMonitor.start()